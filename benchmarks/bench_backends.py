@@ -0,0 +1,127 @@
+"""
+Compare the Pillow and libvips image backends.
+
+Each backend processes the same set of images in a fresh subprocess, so the
+reported peak RSS belongs to that backend alone. Without image arguments a
+set of synthetic 6000x4000 JPEG originals is generated first.
+
+    python benchmarks/bench_backends.py --count 200
+    python benchmarks/bench_backends.py --crop ~/Pictures/headshots/*.jpg
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import pathlib
+import resource
+import tempfile
+import subprocess
+
+SRC_DIR = os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+sys.path.insert(0, SRC_DIR)
+
+
+def make_synthetic_images(directory, count, size=(6000, 4000)):
+    import numpy
+    from PIL import Image as PILImage
+
+    paths = []
+    rng = numpy.random.default_rng(0)
+    # A smooth gradient plus noise compresses like a real photo (~5-20 MB).
+    gradient = numpy.linspace(0, 255, size[0], dtype=numpy.float32)
+    for i in range(count):
+        noise = rng.normal(0, 24, (size[1], size[0], 3)).astype(numpy.float32)
+        pixels = numpy.clip(gradient[None, :, None] + noise, 0, 255)
+        path = os.path.join(directory, f"synthetic_{i:04d}.jpg")
+        PILImage.fromarray(pixels.astype(numpy.uint8)).save(path, quality=95)
+        paths.append(path)
+    return paths
+
+
+def run_backend(backend, paths, crop, resize):
+    """
+    Runs in the child process: process every image and report the results.
+    """
+    from util import make_pipeline
+
+    pipeline = make_pipeline(backend)
+    output_bytes = 0
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as fp:
+            output_bytes += len(pipeline.process(fp.read(), crop, resize))
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    return {
+        "backend": backend,
+        "images": len(paths),
+        "seconds": elapsed,
+        "images_per_second": len(paths) / elapsed,
+        "peak_rss_bytes": peak,
+        "output_bytes": output_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--crop", action="store_true")
+    parser.add_argument("--no-resize", action="store_true")
+    parser.add_argument("--backends", nargs="+", default=["pillow", "vips"])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        print("\n".join(make_synthetic_images(args.generate, args.count)))
+        return
+
+    if args.child:
+        result = run_backend(
+            args.child, args.images, args.crop, not args.no_resize
+        )
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = args.images
+        if not paths:
+            # Generate in a subprocess too: Linux children inherit the
+            # parent's peak RSS, which would otherwise include generation.
+            paths = subprocess.run(
+                [sys.executable, __file__, "--generate", tmp_dir]
+                + ["--count", str(args.count)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+        total = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} images, {total / 1e6:.1f} MB")
+        print(f"{'backend':<10} {'img/s':>10} {'peak RSS MB':>12}")
+        for backend in args.backends:
+            command = [sys.executable, __file__, "--child", backend]
+            if args.crop:
+                command.append("--crop")
+            if args.no_resize:
+                command.append("--no-resize")
+            completed = subprocess.run(
+                command + paths, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{backend:<10} failed: {completed.stderr.strip()}")
+                continue
+            result = json.loads(completed.stdout.splitlines()[-1])
+            print(
+                f"{backend:<10} {result['images_per_second']:>10.2f} "
+                f"{result['peak_rss_bytes'] / 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
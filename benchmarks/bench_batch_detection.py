@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import argparse
+import pathlib
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from PIL import Image as PILImage  # noqa: E402
+from util import (  # noqa: E402
+    DEFAULT_DETECTION,
+    ImagePipeline,
+    detect_face,
+    detect_faces,
+)
+from bench_detection import box_iou  # noqa: E402
+
+"""
+Compare batched face detection with the per-row loop.
+
+The headshots are repeated to make --rows images, and each batch size is
+timed twice: detection alone (detect_faces against detect_face on every
+image), and the whole crop pipeline (ImagePipeline.process_batch against
+process on every row). Boxes and output images are checked against the
+per-row loop's; any that differ are counted as mismatches.
+
+    python benchmarks/bench_batch_detection.py ~/Pictures/headshots/*.jpg
+    python benchmarks/bench_batch_detection.py --batch-sizes 4 16 *.jpg
+"""
+
+
+def load_images(paths, rows):
+    images = [PILImage.open(path).convert("RGB") for path in paths]
+    return [images[index % len(images)] for index in range(rows)]
+
+
+def time_detection(images, batch_size):
+    start = time.perf_counter()
+    if batch_size == 1:
+        boxes = [detect_face(image, DEFAULT_DETECTION) for image in images]
+    else:
+        boxes = detect_faces(images, DEFAULT_DETECTION, batch_size)
+    return boxes, time.perf_counter() - start
+
+
+def time_pipeline(buffers, batch_size):
+    pipeline = ImagePipeline(detect_batch_size=batch_size)
+    start = time.perf_counter()
+    if batch_size == 1:
+        outputs = [pipeline.process(buffer, True, True) for buffer in buffers]
+    else:
+        outputs = []
+        for first in range(0, len(buffers), batch_size):
+            jobs = [
+                (buffer, True, True)
+                for buffer in buffers[first : first + batch_size]
+            ]
+            outputs.extend(img for img, _ in pipeline.process_batch(jobs))
+    return outputs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark batched face detection."
+    )
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--rows", type=int, default=32)
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[4, 8, 16, 32]
+    )
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.rows)
+    buffers = []
+    for path in args.images:
+        with open(path, "rb") as image_fp:
+            buffers.append(image_fp.read())
+    buffers = [buffers[index % len(buffers)] for index in range(args.rows)]
+    print(f"{len(images)} images, detection {tuple(DEFAULT_DETECTION)}")
+
+    # Load the models before timing anything.
+    detect_face(images[0], DEFAULT_DETECTION)
+    reference, _ = time_detection(images, 1)
+    reference_outputs, _ = time_pipeline(buffers, 1)
+
+    print(
+        f"{'batch size':>10} {'detect img/s':>13} {'pipeline img/s':>15} "
+        f"{'min IoU':>8} {'mismatches':>11}"
+    )
+    for batch_size in [1] + [size for size in args.batch_sizes if size > 1]:
+        boxes, detect_seconds = time_detection(images, batch_size)
+        outputs, pipeline_seconds = time_pipeline(buffers, batch_size)
+        ious = [box_iou(a, b) for a, b in zip(reference, boxes)]
+        mismatches = sum(a != b for a, b in zip(reference, boxes))
+        mismatches += sum(a != b for a, b in zip(reference_outputs, outputs))
+        print(
+            f"{batch_size:>10} {len(images) / detect_seconds:>13.2f} "
+            f"{len(buffers) / pipeline_seconds:>15.2f} "
+            f"{min(ious):>8.3f} {mismatches:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
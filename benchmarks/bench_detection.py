@@ -0,0 +1,79 @@
+"""
+Compare face detection strategies on a set of headshots.
+
+For every strategy this reports the mean detection time per image and how
+well its face box agrees (intersection over union) with the reference
+strategy: the CNN detector on the full-resolution image.
+
+    python benchmarks/bench_detection.py ~/Pictures/headshots/*.jpg
+"""
+
+import os
+import sys
+import time
+import argparse
+import pathlib
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from PIL import Image as PILImage  # noqa: E402
+from util import DetectionStrategy, detect_face  # noqa: E402
+
+REFERENCE = DetectionStrategy(model="cnn", proxy_size=0, upsample=0)
+
+
+def box_iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    a_top, a_right, a_bottom, a_left = a
+    b_top, b_right, b_bottom, b_left = b
+    width = min(a_right, b_right) - max(a_left, b_left)
+    height = min(a_bottom, b_bottom) - max(a_top, b_top)
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area_a = (a_right - a_left) * (a_bottom - a_top)
+    area_b = (b_right - b_left) * (b_bottom - b_top)
+    return intersection / (area_a + area_b - intersection)
+
+
+def run_strategy(images, strategy):
+    boxes = []
+    start = time.perf_counter()
+    for image in images:
+        boxes.append(detect_face(image, strategy))
+    elapsed = time.perf_counter() - start
+    return boxes, elapsed / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument(
+        "--proxy-sizes", type=int, nargs="+", default=[0, 1024, 512]
+    )
+    args = parser.parse_args()
+
+    images = [PILImage.open(path).convert("RGB") for path in args.images]
+    print(f"{len(images)} images")
+
+    reference_boxes, reference_time = run_strategy(images, REFERENCE)
+    print(f"{'strategy':<40} {'s/image':>10} {'mean IoU':>10} {'min IoU':>10}")
+    print(f"{str(tuple(REFERENCE)):<40} {reference_time:>10.3f} {1:>10.3f}")
+    for model in ("cnn", "hog"):
+        for proxy_size in args.proxy_sizes:
+            strategy = DetectionStrategy(model, proxy_size, 0)
+            if strategy == REFERENCE:
+                continue
+            boxes, per_image = run_strategy(images, strategy)
+            ious = [box_iou(a, b) for a, b in zip(reference_boxes, boxes)]
+            print(
+                f"{str(tuple(strategy)):<40} {per_image:>10.3f} "
+                f"{sum(ious) / len(ious):>10.3f} {min(ious):>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
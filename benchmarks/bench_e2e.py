@@ -0,0 +1,435 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import pathlib
+import resource
+import tempfile
+import threading
+import logging
+import subprocess
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+SRC_DIR = os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+sys.path.insert(0, SRC_DIR)
+
+"""
+End-to-end benchmark: cast list in, player file and mic cards out.
+
+Generates a synthetic cast list whose rows mix local headshots, headshots
+served over HTTP by a local stand-in server, missing images (absent files,
+404s and empty cells) and large originals, then builds it through
+
+  - the command line path: import_castlist, iter_castlist,
+    create_wavetool_castlist and create_mic_cards, each timed separately;
+  - the web app path: a job submitted to app.py's queue and run by
+    background_process, with stages timed from the messages it logs.
+
+Each path runs in a fresh subprocess so its peak RSS (and that of its crop
+workers) is its own. Results are printed and can be written as JSON with
+--output; --compare prints the change against an earlier results file, e.g.
+one written before a commit.
+
+    python benchmarks/bench_e2e.py --rows 200 --output before.json
+    python benchmarks/bench_e2e.py --rows 200 --compare before.json
+"""
+
+# Fractions of rows of each kind; the rest are local headshots.
+DEFAULT_MIX = {"remote": 0.3, "missing": 0.1, "large": 0.05}
+
+HEADSHOT_SIZE = (800, 1000)
+LARGE_SIZE = (6000, 4000)
+# Distinct images generated; rows of the same kind share them.
+DISTINCT_HEADSHOTS = 40
+DISTINCT_LARGE = 3
+
+# Messages background_process logs at the end of each stage.
+APP_STAGES = (
+    ("import", "Imported cast list"),
+    ("build", "Built processed cast list"),
+    ("pla", "Created WaveTool player file"),
+    ("pdf", "Created Mic Cards PDF file"),
+)
+
+
+def _image(path, size, seed):
+    import numpy
+    from PIL import Image as PILImage
+
+    rng = numpy.random.default_rng(seed)
+    gradient = numpy.linspace(0, 255, size[0], dtype=numpy.float32)
+    noise = rng.normal(0, 24, (size[1], size[0], 3)).astype(numpy.float32)
+    pixels = numpy.clip(gradient[None, :, None] + noise, 0, 255)
+    PILImage.fromarray(pixels.astype(numpy.uint8)).save(path, quality=90)
+
+
+def make_castlist(directory, rows, mix, seed=0):
+    """
+    Write the images and cast.csv for a synthetic cast list to directory.
+    Remote images are written as URLs on "{base_url}", to be filled in
+    once the server's port is known. Returns the number of rows of each
+    kind.
+    """
+    rng = random.Random(seed)
+    images = os.path.join(directory, "images")
+    os.makedirs(images)
+    headshots = [f"images/headshot_{i}.jpg" for i in range(DISTINCT_HEADSHOTS)]
+    large = [f"images/large_{i}.jpg" for i in range(DISTINCT_LARGE)]
+    for i, name in enumerate(headshots):
+        _image(os.path.join(directory, name), HEADSHOT_SIZE, i)
+    for i, name in enumerate(large):
+        _image(os.path.join(directory, name), LARGE_SIZE, 1000 + i)
+
+    counts = dict.fromkeys(["local", *mix], 0)
+    with open(os.path.join(directory, "cast.csv"), "w", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(
+            ["Real Name", "Character", "Comments", "Image", "Crop", "Resize"]
+            + ["Channel"]
+        )
+        for i in range(rows):
+            draw = rng.random()
+            kind = "local"
+            for name, fraction in mix.items():
+                if draw < fraction:
+                    kind = name
+                    break
+                draw -= fraction
+            counts[kind] += 1
+            if kind == "remote":
+                image = "{base_url}/" + rng.choice(headshots)
+            elif kind == "large":
+                image = rng.choice(large)
+            elif kind == "missing":
+                image = rng.choice(
+                    ["images/absent.jpg", "{base_url}/images/absent.jpg", ""]
+                )
+            else:
+                image = rng.choice(headshots)
+            writer.writerow(
+                [
+                    f"Actor {i}",
+                    f"Character {i}",
+                    "Understudy" if i % 7 == 0 else "",
+                    image,
+                    "1",
+                    "1",
+                    str(i + 1),
+                ]
+            )
+    return counts
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory):
+    """
+    Serve directory over HTTP on a free local port from a background
+    thread. Returns the server; its base URL is server.base_url.
+    """
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    )
+
+
+def run_cli(castlist_file, output_dir, workers):
+    """
+    Runs in the child process: build castlist_file the way wavetool.py does
+    and time each stage.
+    """
+    from util import import_castlist, iter_castlist, ImagePipeline
+    from crop_engine import CropEngine
+    from spool import ImageSpool
+    from make_players import create_wavetool_castlist
+    from mic_cards import create_mic_cards
+
+    castlist_path = pathlib.Path(castlist_file).parent.resolve()
+    outputs = {
+        "pla": os.path.join(output_dir, "players.pla"),
+        "pdf": os.path.join(output_dir, "mic_cards.pdf"),
+    }
+    stages = {}
+    start = time.perf_counter()
+    castlist = import_castlist(castlist_file)
+    stages["import"] = time.perf_counter() - start
+    with CropEngine(workers) as engine, ImageSpool() as spool:
+        mark = time.perf_counter()
+        entries = list(
+            iter_castlist(
+                castlist,
+                castlist_path,
+                engine=engine,
+                pipeline=ImagePipeline(),
+                spool=spool,
+            )
+        )
+        stages["build"] = time.perf_counter() - mark
+        mark = time.perf_counter()
+        with open(outputs["pla"], "wb") as out_fp:
+            create_wavetool_castlist(entries, out_fp, castlist_path)
+        stages["pla"] = time.perf_counter() - mark
+        mark = time.perf_counter()
+        with open(outputs["pdf"], "wb") as out_fp:
+            create_mic_cards(entries, out_fp, castlist_path)
+        stages["pdf"] = time.perf_counter() - mark
+    return _result("cli", len(castlist), stages, start, outputs)
+
+
+class _StageTimer(logging.Handler):
+    """
+    Records when each message is logged, as (perf_counter, message).
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.marks = []
+
+    def emit(self, record):
+        self.marks.append((time.perf_counter(), record.getMessage()))
+
+    def find(self, text):
+        return next(mark for mark, message in self.marks if text in message)
+
+
+def run_app(castlist_file, output_dir, workers):
+    """
+    Runs in the child process: submit castlist_file to the web app's job
+    queue, wait for it and time each stage from the messages it logs.
+    """
+    os.environ["WAVETOOL_JOB_DB"] = os.path.join(output_dir, "jobs.sqlite3")
+    os.environ["WAVETOOL_INCREMENTAL"] = "0"
+    if workers is not None:
+        os.environ["WAVETOOL_CROP_WORKERS"] = str(workers)
+    start = time.perf_counter()
+    import app
+    from jobs import COMPLETED, ERROR
+    from crop_engine import shared_engine
+
+    app.start_services()
+    stages = {"startup": time.perf_counter() - start}
+    timer = _StageTimer()
+    logging.getLogger("task").addHandler(timer)
+    task_id = "bench"
+    app.job_store.create(task_id, castlist_file)
+    app.job_queue.notify()
+    while True:
+        job = app.job_store.get(task_id, include_logs=False)
+        if job["status"] in (COMPLETED, ERROR):
+            break
+        time.sleep(0.05)
+    # Stop the crop workers, so that their peak RSS is counted and they do
+    # not outlive this process.
+    shared_engine().close()
+    if job["status"] == ERROR:
+        raise RuntimeError(f"job failed: {job.get('error')}")
+    previous = timer.find(f"Task {task_id} started")
+    for stage, message in APP_STAGES:
+        mark = timer.find(message)
+        stages[stage] = mark - previous
+        previous = mark
+    outputs = {
+        "pla": str(app.OUTPUT_FOLDER / job["pla"]),
+        "pdf": str(app.OUTPUT_FOLDER / job["pdf"]),
+    }
+    return _result(
+        "app",
+        job["progress"]["total"],
+        stages,
+        start,
+        outputs,
+        cleanup=True,
+    )
+
+
+def _result(path, rows, stages, start, outputs, cleanup=False):
+    total = time.perf_counter() - start
+    sizes = {}
+    for name, output in outputs.items():
+        sizes[name] = os.path.getsize(output)
+        if cleanup:
+            os.unlink(output)
+    peak, workers_peak = _peak_rss()
+    return {
+        "path": path,
+        "rows": rows,
+        "seconds": total,
+        "stages": stages,
+        "images_per_second": rows / stages["build"],
+        "peak_rss_bytes": peak,
+        "workers_peak_rss_bytes": workers_peak,
+        "output_bytes": sizes,
+    }
+
+
+def run_child(path, castlist_file, workers):
+    with tempfile.TemporaryDirectory() as output_dir:
+        runner = run_cli if path == "cli" else run_app
+        print(json.dumps(runner(castlist_file, output_dir, workers)))
+    if path == "app":
+        # Exit without waiting for the web app's queue and sweeper threads.
+        sys.stdout.flush()
+        os._exit(0)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    stages = ", ".join(
+        f"{stage} {seconds:.2f}s"
+        for stage, seconds in result["stages"].items()
+    )
+    sizes = ", ".join(
+        f"{name} {size / 1024:.0f} KiB"
+        for name, size in result["output_bytes"].items()
+    )
+    print(
+        f"{result['path']:>4}: {result['seconds']:6.2f} s, "
+        f"{result['images_per_second']:6.1f} images/s, "
+        f"peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB "
+        f"(workers {result['workers_peak_rss_bytes'] / 2**20:.0f} MiB)"
+    )
+    print(f"      {stages}")
+    print(f"      {sizes}")
+
+
+def print_comparison(before, after):
+    print(f"compared with {before.get('commit') or 'previous run'}:")
+    for path, result in after["results"].items():
+        old = before.get("results", {}).get(path)
+        if old is None:
+            continue
+        rows = [("total", old["seconds"], result["seconds"])]
+        rows += [
+            (stage, old["stages"][stage], seconds)
+            for stage, seconds in result["stages"].items()
+            if stage in old["stages"]
+        ]
+        rows.append(
+            ("peak RSS", old["peak_rss_bytes"], result["peak_rss_bytes"])
+        )
+        for name, old_value, new_value in rows:
+            change = (new_value / old_value - 1) * 100 if old_value else 0
+            print(f"{path:>4} {name:<10} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark.")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument(
+        "--paths", nargs="+", choices=("cli", "app"), default=["cli", "app"]
+    )
+    for kind, fraction in DEFAULT_MIX.items():
+        parser.add_argument(
+            f"--{kind}",
+            type=float,
+            default=fraction,
+            help=f"fraction of {kind} images (default: %(default)s)",
+        )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="crop worker processes (default: one per CPU)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    mix = {kind: getattr(args, kind) for kind in DEFAULT_MIX}
+
+    if args.child:
+        run_child(*args.child, args.workers)
+        return
+    if args.generate:
+        print(json.dumps(make_castlist(args.generate, args.rows, mix)))
+        return
+
+    # Images are only ever read from disk or fetched, never cached.
+    os.environ["WAVETOOL_CACHE_DIR"] = ""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Generate in a subprocess too: Linux children inherit the
+        # parent's peak RSS, which would otherwise include generation.
+        command = [sys.executable, __file__, "--generate", tmp_dir]
+        command += ["--rows", str(args.rows), "--seed", str(args.seed)]
+        for kind, fraction in mix.items():
+            command += [f"--{kind}", str(fraction)]
+        counts = json.loads(
+            subprocess.run(
+                command, capture_output=True, text=True, check=True
+            ).stdout
+        )
+        print(
+            f"{args.rows} rows: "
+            + ", ".join(f"{count} {kind}" for kind, count in counts.items())
+        )
+        server = serve(tmp_dir)
+        castlist_file = os.path.join(tmp_dir, "cast.csv")
+        with open(castlist_file) as fp:
+            castlist = fp.read().replace("{base_url}", server.base_url)
+        with open(castlist_file, "w") as fp:
+            fp.write(castlist)
+
+        for path in args.paths:
+            command = [sys.executable, __file__, "--child", path]
+            command.append(castlist_file)
+            if args.workers is not None:
+                command += ["--workers", str(args.workers)]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{path:>4}: failed: {completed.stderr.strip()}")
+                continue
+            results[path] = json.loads(completed.stdout.splitlines()[-1])
+            print_result(results[path])
+        server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "rows": args.rows,
+        "mix": mix,
+        "counts": counts,
+        "workers": args.workers,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            print_comparison(json.load(fp), report)
+
+
+if __name__ == "__main__":
+    main()
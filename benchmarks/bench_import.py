@@ -0,0 +1,97 @@
+import os
+import sys
+import argparse
+import pathlib
+import subprocess
+
+"""
+Benchmark (and guard) the import time of the command line entry points.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+and the total import time and the slowest modules it pulled in are
+reported. Heavy dependencies (face_recognition and dlib, Pillow, numpy,
+requests, pypdf) are only imported once a row needs them; if importing a
+script loads any of them, the benchmark names the module and exits with
+status 1, so it can be run in CI to catch regressions.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --repeat 5 --top 10
+"""
+
+SRC_DIR = os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+
+HEAVY = ("face_recognition", "dlib", "PIL", "numpy", "requests", "pypdf")
+
+# Entry points and the heavy modules that importing them may load: fpdf
+# imports Pillow itself, so mic_cards.py cannot avoid it.
+ENTRY_POINTS = {
+    "util": (),
+    "wavetool": (),
+    "make_players": (),
+    "mic_cards": ("PIL",),
+    "pla": (),
+    "wsm_to_iplist": (),
+}
+
+
+def import_times(module):
+    """
+    Import module in a new interpreter and return {module name: (self us,
+    cumulative us)} as reported by -X importtime.
+    """
+    path = [SRC_DIR] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import times.")
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    # Modules the interpreter loads on startup, before the import itself.
+    startup = import_times("sys")
+    failed = False
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module][1])
+        print(f"{module}: {best[module][1] / 1000:.1f} ms")
+        slowest = sorted(
+            (
+                (cumulative, name)
+                for name, (_, cumulative) in best.items()
+                if name != module and name not in startup and "." not in name
+            ),
+            reverse=True,
+        )
+        for cumulative, name in slowest[: args.top]:
+            print(f"    {name:<24} {cumulative / 1000:7.1f} ms")
+        allowed = ENTRY_POINTS.get(module, ())
+        loaded = [
+            name for name in HEAVY if name in best and name not in allowed
+        ]
+        if loaded:
+            failed = True
+            print(f"    imports {', '.join(loaded)} at startup")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
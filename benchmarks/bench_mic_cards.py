@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import random
+import resource
+import argparse
+import pathlib
+from io import BytesIO
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from PIL import Image  # noqa: E402
+from fpdf import FPDF  # noqa: E402
+from fpdf.enums import XPos, YPos  # noqa: E402
+from pypdf import PdfReader  # noqa: E402
+from mic_cards import create_mic_cards, BACKGROUND_PATH  # noqa: E402
+from spool import ImageSpool  # noqa: E402
+
+"""
+Benchmark mic card PDF generation.
+
+Builds a synthetic deck (by default 200 cards, a quarter of which share the
+default headshot and some actors playing several roles) from spooled JPEGs,
+as the web app does, and times create_mic_cards against the previous
+implementation, which re-read pdfbg.svg on every page and embedded every
+spooled image separately. Reports pages per second, output size and the
+number of images embedded in each PDF. With --chunk-size, also times
+rendering in chunks on --workers processes and reports the largest peak
+RSS of any worker.
+
+    python benchmarks/bench_mic_cards.py --cards 200
+    python benchmarks/bench_mic_cards.py --cards 2000 --chunk-size 50
+"""
+
+
+def legacy_mic_cards(wavetool_castlist, output_file):
+    pdf = FPDF(format="A4")
+    pdf.set_top_margin(25)
+    pdf.set_left_margin(25)
+    pdf.set_right_margin(25)
+    pdf.set_page_background(BACKGROUND_PATH)
+    for character in wavetool_castlist:
+        pdf.add_page()
+        pdf.set_font("helvetica", "B", 12)
+        pdf.cell(
+            0,
+            10,
+            text=f"Channel {character['Channel']}",
+            new_y=YPos.NEXT,
+            new_x=XPos.LMARGIN,
+            align="R",
+        )
+        pdf.set_font("helvetica", "B", 24)
+        pdf.cell(
+            0,
+            10,
+            text=character["RoleName"],
+            new_x=XPos.LMARGIN,
+            new_y=YPos.NEXT,
+            align="C",
+        )
+        pdf.set_font("helvetica", "", 12)
+        for text in (character["Name"], character["Comments"]):
+            pdf.cell(
+                0,
+                10,
+                text=text,
+                new_x=XPos.LMARGIN,
+                new_y=YPos.NEXT,
+                align="C",
+            )
+        box = 75
+        pdf.image(
+            character["Image"].path,
+            w=box,
+            h=box,
+            x=pdf.w / 2 - box / 2,
+            keep_aspect_ratio=True,
+        )
+    pdf.output(output_file)
+
+
+def headshot(seed):
+    rng = random.Random(seed)
+    image = Image.new(
+        "RGB", (512, 512), tuple(rng.randrange(256) for _ in "rgb")
+    )
+    for _ in range(40):
+        x, y = rng.randrange(512), rng.randrange(512)
+        colour = tuple(rng.randrange(256) for _ in "rgb")
+        image.paste(colour, (x, y, min(512, x + 60), min(512, y + 60)))
+    out = BytesIO()
+    image.save(out, "JPEG", quality=75)
+    return out.getvalue()
+
+
+def make_deck(cards, spool, shared_fraction, seed=0):
+    rng = random.Random(seed)
+    default = headshot("default")
+    actors = [headshot(i) for i in range(max(1, int(cards * 0.8)))]
+    deck = []
+    for i in range(cards):
+        if rng.random() < shared_fraction:
+            img_data = default
+        else:
+            img_data = rng.choice(actors)
+        deck.append(
+            {
+                "Channel": str(i + 1),
+                "RoleName": f"Character {i}",
+                "Name": f"Actor {i}",
+                "Comments": "Understudy" if i % 7 == 0 else "",
+                "Image": spool.add(img_data),
+            }
+        )
+    return deck
+
+
+def count_images(pdf_data):
+    images = set()
+    for page in PdfReader(BytesIO(pdf_data)).pages:
+        xobjects = page["/Resources"].get("/XObject", {})
+        for ref in xobjects.values():
+            if ref.get_object()["/Subtype"] == "/Image":
+                images.add(ref.idnum)
+    return len(images)
+
+
+def run(label, render, deck, repeat):
+    best = None
+    for _ in range(repeat):
+        out = BytesIO()
+        start = time.perf_counter()
+        render(deck, out)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    data = out.getvalue()
+    print(
+        f"{label:>8}: {len(deck) / best:7.1f} pages/s, "
+        f"{len(data) / 1024:8.0f} KiB, {count_images(data)} images embedded"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mic card PDFs.")
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--shared", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with ImageSpool() as spool:
+        deck = make_deck(args.cards, spool, args.shared)
+        unique = len({entry["Image"].read() for entry in deck})
+        print(f"{args.cards} cards, {unique} distinct images")
+        run("legacy", legacy_mic_cards, deck, args.repeat)
+        run(
+            "vector",
+            lambda d, o: create_mic_cards(d, o, None, raster_background=False),
+            deck,
+            args.repeat,
+        )
+        run(
+            "raster",
+            lambda d, o: create_mic_cards(d, o, None, raster_background=True),
+            deck,
+            args.repeat,
+        )
+        if args.chunk_size:
+            run(
+                "chunked",
+                lambda d, o: create_mic_cards(
+                    d,
+                    o,
+                    None,
+                    chunk_size=args.chunk_size,
+                    processes=args.workers,
+                ),
+                deck,
+                args.repeat,
+            )
+            # Workers have exited, so they count as reaped children.
+            peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            print(f"largest worker peak RSS: {peak / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import tempfile
+import plistlib
+import tracemalloc
+import argparse
+import pathlib
+from io import BytesIO
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from PIL import Image  # noqa: E402
+from pla import write_pla, validate_pla  # noqa: E402
+from spool import ImageSpool  # noqa: E402
+
+"""
+Benchmark .pla output formats.
+
+Writes a synthetic cast list (--players entries with 512x512 JPEG
+headshots, or --original-size originals for the compressed variant) as an
+XML and as a binary property list, validates that each file reads back to
+the same players, and reports file size, write time and read time (a proxy
+for WaveTool's import). Finally compares the peak memory allocated while
+writing spooled entries with the streaming XML writer against
+plistlib.dump, which needs every image in memory, and checks that the two
+outputs are identical.
+
+    python benchmarks/bench_pla.py --players 200
+"""
+
+
+def headshot(seed, size):
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in "rgb"))
+    for _ in range(60):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        colour = tuple(rng.randrange(256) for _ in "rgb")
+        image.paste(colour, (x, y, x + size[0] // 8, y + size[1] // 8))
+    out = BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def make_entries(players, size):
+    return [
+        {
+            "Comments": "",
+            "Compressed": False,
+            "Image": headshot(i, size),
+            "Name": f"Actor {i}",
+            "RoleName": f"Character {i}",
+            "Scaled": False,
+            "Channel": str(i + 1),
+            "Version": 1,
+        }
+        for i in range(players)
+    ]
+
+
+def run(label, entries, repeat, **options):
+    write_time = read_time = None
+    for _ in range(repeat):
+        out = BytesIO()
+        start = time.perf_counter()
+        write_pla(entries, out, **options)
+        elapsed = time.perf_counter() - start
+        write_time = min(write_time or elapsed, elapsed)
+        out.seek(0)
+        start = time.perf_counter()
+        validate_pla(out, expected=entries)
+        elapsed = time.perf_counter() - start
+        read_time = min(read_time or elapsed, elapsed)
+    print(
+        f"{label:>18}: {out.getbuffer().nbytes / 1024:8.0f} KiB, "
+        f"write {write_time * 1000:7.1f} ms, "
+        f"read+validate {read_time * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark .pla formats.")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--original-size", type=int, default=1600)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    entries = make_entries(args.players, (512, 512))
+    print(f"{args.players} players, processed 512x512 JPEGs")
+    run("xml", entries, args.repeat, fmt="xml")
+    run("binary", entries, args.repeat, fmt="binary")
+
+    size = (args.original_size, args.original_size * 4 // 3)
+    originals = make_entries(args.players, size)
+    print(f"{args.players} players, unprocessed {size[0]}x{size[1]} JPEGs")
+    run("xml", originals, args.repeat, fmt="xml")
+    run(
+        "binary compressed",
+        originals,
+        args.repeat,
+        fmt="binary",
+        compress_images=True,
+    )
+
+    with ImageSpool() as spool:
+        spooled = [
+            dict(entry, Image=spool.add(entry["Image"])) for entry in entries
+        ]
+        del entries, originals
+        print(f"peak memory writing {args.players} spooled players as XML")
+        streamed = peak_memory(lambda out: write_pla(spooled, out))
+        dumped = peak_memory(
+            lambda out: plistlib.dump(
+                [dict(e, Image=e["Image"].read()) for e in spooled], out
+            )
+        )
+        print(f"{'streaming':>18}: {streamed[0] / 1024:8.0f} KiB")
+        print(f"{'plistlib.dump':>18}: {dumped[0] / 1024:8.0f} KiB")
+        print(f"identical output: {streamed[1] == dumped[1]}")
+
+
+def peak_memory(write):
+    """
+    Return (peak bytes allocated by write, excluding its output, output).
+    """
+    with tempfile.TemporaryFile() as out:
+        tracemalloc.start()
+        write(out)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out.seek(0)
+        return peak, hashlib.sha256(out.read()).hexdigest()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import random
+import plistlib
+import resource
+import argparse
+import pathlib
+import tempfile
+import subprocess
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from wsm_to_iplist import wsm_to_wtip  # noqa: E402
+
+"""
+Benchmark WSM to IP list conversion.
+
+Writes a synthetic WSM configuration (by default 10,000 devices spread over
+several venues, a few of them listed twice) and converts it with the
+streaming extractor and with the previous BeautifulSoup implementation,
+which parsed the whole file into a tree first. Each conversion runs in its
+own process so that its peak RSS can be reported.
+
+    python benchmarks/bench_wsm.py --devices 10000
+"""
+
+DEVICE_TYPES = ("EM 6000", "SR 2050 IEM", "ASA 214", "L 6000", "SKM 6000")
+
+
+def make_wsm(path, devices, duplicates=0.02, seed=0):
+    rng = random.Random(seed)
+    venues = max(1, devices // 1000)
+    ips = [
+        f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        for i in range(devices)
+    ]
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write("<WSMConfiguration>\n  <Venues>\n")
+        for venue in range(venues):
+            f.write(f'    <Venue Name="Venue {venue}">\n      <Devices>\n')
+            for i in range(venue, devices, venues):
+                ip = ips[i]
+                if rng.random() < duplicates:
+                    ip = rng.choice(ips)
+                f.write(
+                    "        <Device>\n"
+                    f"          <Name>RX {i}</Name>\n"
+                    f"          <Type>{rng.choice(DEVICE_TYPES)}</Type>\n"
+                    "          <Frequency>"
+                    f"{rng.randrange(470000, 790000)}</Frequency>\n"
+                    "          <Network>\n"
+                    f"            <IPAddress>{ip}</IPAddress>\n"
+                    "            <SubnetMask>255.255.0.0</SubnetMask>\n"
+                    "          </Network>\n"
+                    "        </Device>\n"
+                )
+            f.write("      </Devices>\n    </Venue>\n")
+        f.write("  </Venues>\n</WSMConfiguration>\n")
+
+
+def legacy_wsm_to_wtip(source_file, output_file):
+    from bs4 import BeautifulSoup
+
+    ip_addresses = []
+    with open(source_file, "r") as f:
+        soup = BeautifulSoup(f, "xml")
+        for ip_field in soup.find_all("IPAddress"):
+            ip_addresses.append([ip_field.text, 3])
+    with open(output_file, "wb") as out_fp:
+        plistlib.dump(ip_addresses, out_fp)
+
+
+def convert(mode, source_file, output_file):
+    start = time.perf_counter()
+    if mode == "legacy":
+        legacy_wsm_to_wtip(source_file, output_file)
+    else:
+        wsm_to_wtip(source_file, output_file, with_details=mode == "details")
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {peak}")
+
+
+def run(mode, source_file, output_file):
+    result = subprocess.run(
+        [sys.executable, __file__, "--run", mode, source_file, output_file],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    elapsed, peak = result.stdout.split()
+    with open(output_file, "rb") as f:
+        count = len(plistlib.load(f))
+    print(
+        f"{mode:>8}: {float(elapsed):6.2f} s, "
+        f"peak RSS {int(peak) / 1024:6.0f} MiB, {count} addresses"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WSM conversion.")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--run", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        convert(*args.run)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source_file = os.path.join(tmp, "bench.wsm")
+        make_wsm(source_file, args.devices)
+        size = os.path.getsize(source_file)
+        print(f"{args.devices} devices, {size / 1024 / 1024:.1f} MiB")
+        for mode in ("legacy", "stream", "details"):
+            run(mode, source_file, os.path.join(tmp, f"{mode}.wip"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import pathlib
+from io import BytesIO
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from PIL import Image as PILImage  # noqa: E402
+from util import ImagePipeline  # noqa: E402
+
+"""
+Check that the Pillow pipeline's draft decode reduces camera originals.
+
+Landscape, portrait and 3:2 JPEGs are decoded as for a cropped and resized
+row, and as for a resized-only row. Each must come back at the largest JPEG
+reduction (1/2, 1/4 or 1/8) that still covers what the next step needs: a
+long edge of at least draft_size before cropping, or the thumbnail size.
+(A 3000x2000 original cannot be halved without its long edge dropping below
+2048, so it is decoded in full for cropping.) Exits with status 1 if any
+image decodes at another size.
+
+    python benchmarks/check_draft_decode.py
+"""
+
+SIZES = ((6000, 4000), (4000, 6000), (3000, 2000))
+
+
+def jpeg(size):
+    out = BytesIO()
+    PILImage.new("RGB", size, (120, 90, 60)).save(out, "JPEG")
+    return out.getvalue()
+
+
+def expected_size(size, needed):
+    """
+    The size of the largest JPEG reduction whose long edge is still at
+    least needed.
+    """
+    for scale in (8, 4, 2, 1):
+        reduced = tuple(-(-edge // scale) for edge in size)
+        if max(reduced) >= needed:
+            return reduced
+
+
+def main():
+    pipeline = ImagePipeline()
+    failed = False
+    for size in SIZES:
+        data = jpeg(size)
+        for crop, needed in ((True, pipeline.draft_size), (False, None)):
+            decoded = pipeline.decode(data, crop, True).size
+            if needed is None:
+                # Resize only: the thumbnail fits inside pipeline.size.
+                scale = min(
+                    pipeline.size[0] / size[0], pipeline.size[1] / size[1]
+                )
+                needed = round(max(size) * scale)
+            expected = expected_size(size, needed)
+            ok = decoded == expected
+            failed = failed or not ok
+            mode = "crop+resize" if crop else "resize"
+            print(
+                f"{'ok' if ok else 'FAIL':<5} {mode:<12} "
+                f"{size[0]}x{size[1]} -> {decoded[0]}x{decoded[1]} "
+                f"(expected {expected[0]}x{expected[1]})"
+            )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import sys
+import pathlib
+import tempfile
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+from sheets_parser import (  # noqa: E402
+    GRID_FIELDS,
+    SheetCache,
+    google_sheet_rows,
+)
+
+"""
+Check google_sheet_rows against stub Sheets and Drive clients.
+
+The stubs stand in for the discovery-built services and record every
+request. The check confirms that:
+  - the grid is requested with the GRID_FIELDS field mask (and not
+    includeGridData);
+  - a second fetch at the same Drive version is served from the cache
+    without calling the Sheets API, and a new version fetches again;
+  - an Image cell's Drive sharing hyperlink is rewritten to a direct
+    uc?export=view link, while plain values are kept.
+Exits with status 1 if any check fails.
+
+    python benchmarks/check_sheets_parser.py
+"""
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/SHEET123/edit#gid=0"
+SHARE_URL = "https://drive.google.com/file/d/FILE456/view?usp=share_link"
+DIRECT_URL = "https://drive.google.com/uc?export=view&id=FILE456"
+
+GRID = {
+    "sheets": [
+        {
+            "data": [
+                {
+                    "rowData": [
+                        {
+                            "values": [
+                                {"formattedValue": "Real Name"},
+                                {"formattedValue": "Character"},
+                                {"formattedValue": "Image"},
+                            ]
+                        },
+                        {
+                            "values": [
+                                {"formattedValue": "Alex"},
+                                {"formattedValue": "Lead"},
+                                {
+                                    "formattedValue": "a",
+                                    "hyperlink": SHARE_URL,
+                                },
+                            ]
+                        },
+                        {
+                            "values": [
+                                {"formattedValue": "Sam"},
+                                {"formattedValue": "Chorus"},
+                                {"formattedValue": "sam.jpg"},
+                            ]
+                        },
+                    ]
+                }
+            ]
+        }
+    ]
+}
+
+
+class _Request:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class StubSheets:
+    """
+    Stands in for build("sheets", "v4"); records spreadsheets().get calls.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def get(self, **kwargs):
+        self.calls.append(kwargs)
+        return _Request(self.grid)
+
+
+class StubDrive:
+    """
+    Stands in for build("drive", "v3"); files().get returns version.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.calls = []
+
+    def files(self):
+        return self
+
+    def get(self, **kwargs):
+        self.calls.append(kwargs)
+        return _Request({"version": self.version})
+
+
+def main():
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok' if ok else 'FAIL':<5} {name}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = SheetCache(cache_dir)
+        sheets = StubSheets(GRID)
+        drive = StubDrive("7")
+
+        def fetch():
+            return google_sheet_rows(
+                SHEET_URL,
+                "key",
+                service=sheets,
+                drive_service=drive,
+                cache=cache,
+            )
+
+        rows = fetch()
+        [request] = sheets.calls
+        check(
+            "grid requested with the field mask",
+            request.get("fields") == GRID_FIELDS
+            and request.get("spreadsheetId") == "SHEET123"
+            and "includeGridData" not in request,
+        )
+        check(
+            "Drive version requested as metadata only",
+            drive.calls[0].get("fields") == "version",
+        )
+        check(
+            "Drive sharing hyperlink rewritten to uc?export=view",
+            rows[1] == ["Alex", "Lead", DIRECT_URL],
+        )
+        check("plain values kept", rows[2] == ["Sam", "Chorus", "sam.jpg"])
+
+        cached_rows = fetch()
+        check(
+            "same version served from the cache without a Sheets call",
+            len(sheets.calls) == 1 and cached_rows == rows,
+        )
+
+        drive.version = "8"
+        fetch()
+        check("new version fetched again", len(sheets.calls) == 2)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Soak test for per-task log routing.
+
+Runs thousands of simulated jobs, each on its own thread logging through the
+"util" logger, and compares the per-line logging cost of the first and last
+batches of jobs. With task_logging the cost stays flat; --legacy reproduces
+the old behaviour (a handler added to "util" per job and never removed) for
+comparison. Exits non-zero if the last batch is more than --max-ratio times
+slower than the first.
+
+    python benchmarks/soak_task_logging.py --jobs 5000
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import pathlib
+import threading
+
+sys.path.insert(
+    0, os.path.join(str(pathlib.Path(__file__).parent.resolve()), "../src")
+)
+
+import task_logging  # noqa: E402
+
+
+class LegacyHandler(logging.Handler):
+    def __init__(self, task_id, sink):
+        super().__init__()
+        self.task_id = task_id
+        self.sink = sink
+
+    def emit(self, record):
+        self.sink(self.task_id, self.format(record))
+
+
+def run_job(task_id, lines, sink, legacy):
+    util_logger = logging.getLogger("util")
+    if legacy:
+        handler = LegacyHandler(task_id, sink)
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+        util_logger.addHandler(handler)
+    with task_logging.task_context(task_id):
+        start = time.perf_counter()
+        for i in range(lines):
+            util_logger.info(f"Processing row {i}")
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    received = {}
+
+    def sink(task_id, message):
+        received[task_id] = received.get(task_id, 0) + 1
+
+    if not args.legacy:
+        task_logging.install(sink, ["util"])
+    else:
+        logging.getLogger("util").setLevel(logging.INFO)
+
+    timings = []
+    for job in range(args.jobs):
+        result = {}
+        thread = threading.Thread(
+            target=lambda: result.setdefault(
+                "elapsed",
+                run_job(f"job{job}", args.lines, sink, args.legacy),
+            )
+        )
+        thread.start()
+        thread.join()
+        timings.append(result["elapsed"] / args.lines)
+
+    first = sum(timings[: args.batch]) / args.batch
+    last = sum(timings[-args.batch :]) / args.batch
+    # Every job should have received exactly its own lines.
+    misrouted = sum(1 for n in received.values() if n != args.lines)
+    print(f"jobs: {args.jobs}, lines per job: {args.lines}")
+    print(f"first {args.batch} jobs: {first * 1e6:.1f} us/line")
+    print(f"last {args.batch} jobs:  {last * 1e6:.1f} us/line")
+    print(f"jobs with misrouted lines: {misrouted}")
+    if misrouted or last > first * args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
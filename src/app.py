@@ -1,19 +1,37 @@
 import os
+import json
+import time
 import uuid
+import hashlib
 import pathlib
-import threading
+import contextlib
 import logging
+import threading
 from flask import (
     Flask,
     request,
     render_template,
     url_for,
     send_from_directory,
-    after_this_request,
     jsonify,
+    Response,
+    stream_with_context,
 )
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from jobs import (
+    JobStore,
+    JobQueue,
+    QueueFull,
+    QUEUED,
+    PROCESSING,
+    COMPLETED,
+    ERROR,
+)
+from retention import RetentionPolicy, Sweeper
+from crop_engine import shared_engine, warm_start_enabled
+import task_logging
+import metrics
 
 load_dotenv()
 app = Flask(__name__)
@@ -21,28 +39,50 @@ app = Flask(__name__)
 BASE_DIR = pathlib.Path(__file__).parent.resolve()
 UPLOAD_FOLDER = BASE_DIR / "uploads"
 OUTPUT_FOLDER = BASE_DIR / "outputs"
+# Incremental build directories, one per cast list source (see
+# incremental.py), so resubmitting a sheet only reprocesses the rows that
+# changed. Only processed images are reused; mic cards are rendered afresh.
+BUILD_FOLDER = BASE_DIR / "builds"
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 OUTPUT_FOLDER.mkdir(exist_ok=True)
+BUILD_FOLDER.mkdir(exist_ok=True)
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_FOLDER)
+# Job state is kept in SQLite so it survives restarts and is shared by every
+# worker process. MAX_RUNNING_JOBS bounds how many jobs process at once
+# across all processes; submissions beyond MAX_QUEUED_JOBS waiting jobs are
+# refused with 429.
+app.config["JOB_DB"] = os.environ.get(
+    "WAVETOOL_JOB_DB", str(BASE_DIR / "jobs.sqlite3")
+)
+app.config["MAX_RUNNING_JOBS"] = int(
+    os.environ.get("WAVETOOL_MAX_RUNNING_JOBS", 2)
+)
+app.config["MAX_QUEUED_JOBS"] = int(
+    os.environ.get("WAVETOOL_MAX_QUEUED_JOBS", 20)
+)
+app.config["PLA_FORMAT"] = os.environ.get("WAVETOOL_PLA_FORMAT", "xml")
+app.config["INCREMENTAL_BUILDS"] = os.environ.get(
+    "WAVETOOL_INCREMENTAL", "1"
+).lower() not in ("0", "false", "no")
+# An upload only reuses the build of an identical file, which is rarely
+# submitted twice, so incremental builds of uploaded CSVs are off by default.
+app.config["INCREMENTAL_UPLOADS"] = os.environ.get(
+    "WAVETOOL_INCREMENTAL_UPLOADS", "0"
+).lower() not in ("0", "false", "no")
+# Start the image processing workers and load the face detection models when
+# the app starts, rather than during the first job that crops an image.
+app.config["WARM_START"] = warm_start_enabled()
 
 ALLOWED_CSV_EXTENSIONS = {"csv"}
 
-# Global dictionary to hold task status.
-tasks = {}
-
-
-# Custom logging handler that writes logs to tasks[task_id]["logs"].
-class TaskLogHandler(logging.Handler):
-    def __init__(self, task_id):
-        super().__init__()
-        self.task_id = task_id
+# Seconds between checks for new log lines in an event stream.
+SSE_POLL_INTERVAL = 0.5
 
-    def emit(self, record):
-        msg = self.format(record)
-        if self.task_id in tasks:
-            if "logs" not in tasks[self.task_id]:
-                tasks[self.task_id]["logs"] = []
-            tasks[self.task_id]["logs"].append(msg)
+# Set by start_services().
+job_store = None
+job_queue = None
+sweeper = None
+_services_lock = threading.Lock()
 
 
 def allowed_file(filename):
@@ -52,44 +92,84 @@ def allowed_file(filename):
     )
 
 
+def build_dir_for_source(input_source):
+    """
+    Return the incremental build directory for a cast list source: keyed by
+    the sheet URL, or by a hash of an uploaded CSV's contents, so uploads
+    that merely share a filename never share (or prune) a build.
+    """
+    if input_source.startswith("http"):
+        source_id = input_source.encode()
+    else:
+        with open(input_source, "rb") as csv_fp:
+            source_id = hashlib.sha256(csv_fp.read()).digest()
+    return BUILD_FOLDER / hashlib.sha256(source_id).hexdigest()[:16]
+
+
+def incremental_enabled(input_source):
+    if input_source.startswith("http"):
+        return app.config["INCREMENTAL_BUILDS"]
+    return app.config["INCREMENTAL_UPLOADS"]
+
+
 def background_process(task_id, input_source, api_key):
-    # Create a dedicated logger for this task.
-    logger = logging.getLogger(f"task_{task_id}")
-    logger.setLevel(logging.INFO)
-
-    # Create and attach the custom handler.
-    handler = TaskLogHandler(task_id)
-    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-    # Also attach the same handler to the "util" logger so logs from util.py are captured.
-    util_logger = logging.getLogger("util")
-    util_logger.setLevel(logging.INFO)
-    util_logger.propagate = True
-    util_logger.addHandler(handler)
+    # Records logged in this context are routed to this task's job log.
+    with task_logging.task_context(task_id):
+        _process_job(task_id, input_source, api_key)
+
+
+def _process_job(task_id, input_source, api_key):
+    # Time spent in each stage, reported with the job's status.
+    timings = metrics.JobTimings()
+    timings_token = metrics.current_job.set(timings)
+    logger = logging.getLogger("task")
 
     logger.info(f"Task {task_id} started processing.")
     try:
-        # If input_source is a URL, convert the Google Sheet to CSV.
+        from util import (
+            DEFAULT_DETECTION,
+            import_castlist,
+            castlist_from_table,
+            iter_castlist,
+            make_pipeline,
+        )
+        from image_cache import default_cache
+        from incremental import IncrementalBuild
+        from spool import ImageSpool
+
+        # If input_source is a URL, read the Google Sheet's rows straight
+        # into the cast list; otherwise import the uploaded CSV.
         if input_source.startswith("http"):
-            from sheets_parser import google_sheet_to_csv
+            from sheets_parser import google_sheet_rows
 
-            csv_path = google_sheet_to_csv(input_source, api_key)
-            logger.info(f"Converted Google Sheet to CSV: {csv_path}")
+            castlist = castlist_from_table(
+                google_sheet_rows(input_source, api_key)
+            )
+            logger.info("Read cast list from Google Sheet.")
+            # Sheet images are URLs; there is no directory to resolve
+            # relative paths against.
+            castlist_path = None
         else:
-            csv_path = input_source
-            logger.info(f"Using uploaded CSV: {csv_path}")
-
-        # Import the cast list and build the processed array.
-        from util import import_castlist, build_castlist
+            castlist = import_castlist(input_source)
+            logger.info(f"Using uploaded CSV: {input_source}")
+            castlist_path = pathlib.Path(input_source).parent.resolve()
 
-        castlist = import_castlist(csv_path)
-        castlist_path = pathlib.Path(csv_path).parent.resolve()
         logger.info(f"Imported cast list with {len(castlist)} entries.")
-        wavetool_castlist = build_castlist(castlist, castlist_path)
-        logger.info(
-            f"Built processed cast list with {len(wavetool_castlist)} entries."
+        job_store.update(
+            task_id, progress_done=0, progress_total=len(castlist)
+        )
+        pipeline = make_pipeline(
+            os.environ.get("WAVETOOL_IMAGE_BACKEND", "pillow"),
+            detection=DEFAULT_DETECTION._replace(
+                proxy_size=int(
+                    os.environ.get(
+                        "WAVETOOL_DETECT_SIZE", DEFAULT_DETECTION.proxy_size
+                    )
+                )
+            ),
+            detect_batch_size=int(
+                os.environ.get("WAVETOOL_DETECT_BATCH_SIZE", 1)
+            ),
         )
 
         # Generate output filenames.
@@ -98,33 +178,156 @@ def background_process(task_id, input_source, api_key):
         output_pla_path = OUTPUT_FOLDER / output_pla_filename
         output_pdf_path = OUTPUT_FOLDER / output_pdf_filename
 
-        # Generate the WaveTool player file.
         from make_players import create_wavetool_castlist
-
-        with open(output_pla_path, "wb") as f_pla:
-            create_wavetool_castlist(wavetool_castlist, f_pla, castlist_path)
-        logger.info(f"Created WaveTool player file: {output_pla_filename}")
-
-        # Generate the mic cards PDF.
         from mic_cards import create_mic_cards
 
-        with open(output_pdf_path, "wb") as f_pdf:
-            create_mic_cards(wavetool_castlist, f_pdf, castlist_path)
-        logger.info(f"Created Mic Cards PDF file: {output_pdf_filename}")
+        # Stream the processed entries, spilling images to a spool directory
+        # so building them does not hold every image. (Writing the PDF, and
+        # a binary player file, still does; see mic_cards.create_mic_cards.)
+        if incremental_enabled(input_source):
+            incremental = IncrementalBuild(build_dir_for_source(input_source))
+        else:
+            incremental = contextlib.nullcontext()
+        with ImageSpool() as spool, incremental as build:
+            # Entries only reference their spooled images, so keeping them
+            # for the second writer is cheap.
+            wavetool_castlist = []
+            for entry in iter_castlist(
+                castlist,
+                castlist_path,
+                cache=default_cache(),
+                pipeline=pipeline,
+                spool=spool,
+                incremental=build,
+            ):
+                wavetool_castlist.append(entry)
+                job_store.update(
+                    task_id,
+                    progress_done=len(wavetool_castlist),
+                    timings=timings.as_dict(),
+                )
+            logger.info(
+                f"Built processed cast list with {len(wavetool_castlist)} entries."
+            )
 
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["pla"] = output_pla_filename
-        tasks[task_id]["pdf"] = output_pdf_filename
+            # Generate the WaveTool player file.
+            with open(output_pla_path, "wb") as f_pla:
+                create_wavetool_castlist(
+                    wavetool_castlist,
+                    f_pla,
+                    castlist_path,
+                    fmt=app.config["PLA_FORMAT"],
+                )
+            logger.info(f"Created WaveTool player file: {output_pla_filename}")
+
+            # Generate the mic cards PDF.
+            with open(output_pdf_path, "wb") as f_pdf:
+                create_mic_cards(
+                    wavetool_castlist, f_pdf, castlist_path, incremental=build
+                )
+            logger.info(f"Created Mic Cards PDF file: {output_pdf_filename}")
+
+        job_store.update(
+            task_id,
+            status=COMPLETED,
+            pla=output_pla_filename,
+            pdf=output_pdf_filename,
+            finished=time.time(),
+            timings=timings.as_dict(),
+        )
         logger.info(f"Task {task_id} completed successfully.")
     except Exception as e:
-        tasks[task_id]["status"] = "error"
-        tasks[task_id]["error"] = str(e)
+        job_store.update(
+            task_id,
+            status=ERROR,
+            error=str(e),
+            finished=time.time(),
+            timings=timings.as_dict(),
+        )
         logger.exception(f"Task {task_id} encountered an error.")
+    finally:
+        metrics.current_job.reset(timings_token)
+
+
+def run_job(task_id, input_source):
+    """
+    Run a queued job (called from a JobQueue worker thread), then remove its
+    uploaded CSV.
+    """
+    is_sheet = input_source.startswith("http")
+    api_key = os.environ.get("GOOGLE_API_KEY") if is_sheet else None
+    try:
+        background_process(task_id, input_source, api_key)
+    finally:
+        if not is_sheet and pathlib.Path(input_source).parent == UPLOAD_FOLDER:
+            try:
+                pathlib.Path(input_source).unlink(missing_ok=True)
+            except Exception as cleanup_err:
+                app.logger.error(f"Cleanup error: {cleanup_err}")
+
+
+def check_config():
+    """
+    Raise ValueError for settings that would only fail once a job runs.
+    Called on startup (see start_services and gunicorn.conf.py).
+    """
+    # Imported here: pla needs util, whose face detection models are heavy.
+    from pla import PLA_FORMATS
+
+    if app.config["PLA_FORMAT"] not in PLA_FORMATS:
+        raise ValueError(
+            f"Unknown WAVETOOL_PLA_FORMAT {app.config['PLA_FORMAT']!r}; "
+            f"expected one of: {', '.join(sorted(PLA_FORMATS))}"
+        )
+
+
+def start_services():
+    """
+    Open the job store and start this process's job workers, retention
+    sweeper and, with WARM_START, image workers. Each serving process calls
+    this once: the __main__ block below, or gunicorn's post_fork hook (see
+    gunicorn.conf.py). It must not run on import, because image and PDF
+    workers are spawned processes that import the main module again, and
+    they must neither run jobs nor spawn workers of their own.
+    """
+    global job_store, job_queue, sweeper
+    with _services_lock:
+        if job_store is not None:
+            return
+        check_config()
+        job_store = JobStore(app.config["JOB_DB"])
+
+        # One handler for the whole process routes records from the task
+        # logger and from util.py (and its helper modules) to the job
+        # running in the current context.
+        task_logging.install(job_store.append_log, ["task", "util"])
+
+        job_queue = JobQueue(
+            job_store, run_job, max_running=app.config["MAX_RUNNING_JOBS"]
+        )
+        job_queue.start()
+
+        sweeper = Sweeper(
+            job_store,
+            OUTPUT_FOLDER,
+            RetentionPolicy.from_env(),
+            interval=float(os.environ.get("WAVETOOL_SWEEP_INTERVAL", 600)),
+            build_dir=BUILD_FOLDER,
+        )
+        sweeper.start()
+
+        if app.config["WARM_START"]:
+            # In the background, so the app can serve requests while models
+            # load.
+            threading.Thread(
+                target=shared_engine().warm, name="warm-start", daemon=True
+            ).start()
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
+        task_id = str(uuid.uuid4())[:8]
         sheet_link = request.form.get("sheet_link", "").strip()
         csv_path = None
         if sheet_link:
@@ -132,7 +335,8 @@ def index():
         elif "file" in request.files and request.files["file"].filename:
             file = request.files["file"]
             if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
+                # Uploads wait in the queue, so give each a unique name.
+                filename = f"{task_id}_{secure_filename(file.filename)}"
                 csv_path = pathlib.Path(app.config["UPLOAD_FOLDER"]) / filename
                 file.save(str(csv_path))
                 input_source = str(csv_path)
@@ -159,46 +363,182 @@ def index():
         if sheet_link and not api_key:
             return jsonify({"error": "Google API Key not set."}), 400
 
-        task_id = str(uuid.uuid4())[:8]
-        tasks[task_id] = {"status": "processing", "logs": []}
-        threading.Thread(
-            target=background_process,
-            args=(task_id, input_source, api_key),
-            daemon=True,
-        ).start()
-
-        @after_this_request
-        def cleanup(response):
-            try:
-                if csv_path and pathlib.Path(csv_path).exists():
-                    pathlib.Path(csv_path).unlink()
-            except Exception as cleanup_err:
-                app.logger.error(f"Cleanup error: {cleanup_err}")
-            return response
-
-        return jsonify({"redirect": url_for("status", task_id=task_id)})
+        try:
+            position = job_store.create(
+                task_id, input_source, app.config["MAX_QUEUED_JOBS"]
+            )
+        except QueueFull as e:
+            if csv_path is not None:
+                csv_path.unlink(missing_ok=True)
+            response = jsonify(
+                {
+                    "error": "The server is busy. Please try again shortly.",
+                    "queue_length": e.queued,
+                }
+            )
+            response.headers["Retry-After"] = "30"
+            return response, 429
+        job_queue.notify()
+
+        return jsonify(
+            {
+                "redirect": url_for("status", task_id=task_id),
+                "queue_position": position,
+            }
+        )
     else:
         return render_template("index.html")
 
 
 @app.route("/status/<task_id>")
 def status(task_id):
-    if task_id not in tasks:
+    if not job_store.exists(task_id):
         return "Invalid task ID.", 404
     return render_template("status.html", task_id=task_id)
 
 
 @app.route("/api/status/<task_id>")
 def api_status(task_id):
-    if task_id not in tasks:
+    job = job_store.get(task_id)
+    if job is None:
         return jsonify({"status": "not found"})
-    return jsonify(tasks[task_id])
+    return jsonify(job)
+
+
+@app.route("/api/logs/<task_id>")
+def api_logs(task_id):
+    """
+    Incremental status: only the log lines after the ?cursor= value, and
+    the cursor to send next time.
+    """
+    job = job_store.get(task_id, include_logs=False)
+    if job is None:
+        return jsonify({"status": "not found"}), 404
+    cursor = request.args.get("cursor", 0, type=int)
+    job["lines"], job["cursor"] = job_store.get_logs(task_id, cursor)
+    return jsonify(job)
+
+
+def sse_event(event, data, event_id=None):
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/stream/<task_id>")
+def api_stream(task_id):
+    """
+    Server-Sent Events stream of a job's log lines ("log" events), progress
+    and status ("status" events) as they happen. The stream ends once the
+    job has completed or failed, or with a "not found" status if the job is
+    removed meanwhile. Reconnecting clients resume from the Last-Event-ID
+    header.
+    """
+    if not job_store.exists(task_id):
+        return jsonify({"status": "not found"}), 404
+    cursor = request.headers.get("Last-Event-ID", 0, type=int)
+
+    def events():
+        nonlocal cursor
+        last_state = None
+        while True:
+            job = job_store.get(task_id, include_logs=False)
+            if job is None:
+                # Evicted or swept while the client was watching.
+                yield sse_event("status", {"status": "not found"})
+                return
+            lines, new_cursor = job_store.get_logs(task_id, cursor)
+            for offset, line in enumerate(lines):
+                # Only the last line of a batch carries the real cursor.
+                last = offset == len(lines) - 1
+                yield sse_event(
+                    "log", line, event_id=new_cursor if last else None
+                )
+            cursor = new_cursor
+            if job != last_state:
+                yield sse_event("status", job)
+                last_state = job
+            if job["status"] in (COMPLETED, ERROR) and not lines:
+                return
+            if not lines:
+                time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/download/<filename>")
 def download_file(filename):
+    path = OUTPUT_FOLDER / secure_filename(filename)
+    if path.is_file():
+        # Mark the file and its job as recently used for retention.
+        os.utime(path)
+        job_store.touch(filename.split("_", 1)[0])
     return send_from_directory(str(OUTPUT_FOLDER), filename, as_attachment=True)
 
 
+@app.route("/api/retention")
+def api_retention():
+    return jsonify(sweeper.stats)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus metrics: stage time histograms for jobs run by this process,
+    jobs by status, and how busy the job and image processing workers are.
+    """
+    counts = job_store.counts()
+    engine = shared_engine()
+    gauges = [
+        (
+            "wavetool_jobs",
+            "Jobs by status.",
+            {
+                (("status", status),): counts.get(status, 0)
+                for status in (QUEUED, PROCESSING, COMPLETED, ERROR)
+            },
+        ),
+        (
+            "wavetool_queue_depth",
+            "Jobs waiting to be processed.",
+            {(): counts.get(QUEUED, 0)},
+        ),
+        (
+            "wavetool_job_workers",
+            "Job worker threads in this process.",
+            {(): job_queue.max_running},
+        ),
+        (
+            "wavetool_job_workers_busy",
+            "Job worker threads running a job.",
+            {(): job_queue.busy},
+        ),
+        (
+            "wavetool_crop_workers",
+            "Image processing worker processes.",
+            {(): max(engine.processes, 1)},
+        ),
+        (
+            "wavetool_crop_workers_busy",
+            "Image processing workers processing an image.",
+            {(): engine.busy},
+        ),
+    ]
+    return Response(
+        metrics.prometheus_text(gauges),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
 if __name__ == "__main__":
+    check_config()
+    # The debug reloader runs the app in a child process (with
+    # WERKZEUG_RUN_MAIN set) and only watches for changes in this one.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
     app.run(debug=True)
@@ -0,0 +1,112 @@
+import logging
+import pathlib
+import threading
+from crop_engine import shared_engine
+
+"""
+Bundled assets: the default headshot and the mic card background.
+
+Every row without a usable image gets the same default headshot, so instead
+of reading defaultimage.tiff and running it through face detection and the
+image pipeline again for each row, it is read once per process and each
+processed variant (one per set of pipeline options) is made once. Assets are
+handed out as bytes or other values that callers never modify, so every row
+shares the same buffer.
+"""
+
+logger = logging.getLogger("util.assets")
+
+ASSET_DIR = pathlib.Path(__file__).parent.resolve().parent
+DEFAULT_IMAGE_PATH = str(ASSET_DIR / "defaultimage.tiff")
+BACKGROUND_PATH = str(ASSET_DIR / "pdfbg.svg")
+
+
+class AssetRegistry:
+    """
+    Values computed once per process: get(key, load) calls load() the first
+    time key is asked for and returns the same value from then on. Loads of
+    different keys may run concurrently; each key is loaded only once.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._values:
+                self._values[key] = load()
+            return self._values[key]
+
+    def holds(self, value):
+        """
+        Return True if value is one of the registry's own values, rather
+        than an equal copy.
+        """
+        return any(value is held for held in list(self._values.values()))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._key_locks.clear()
+
+
+registry = AssetRegistry()
+
+
+def read_asset(path):
+    """
+    Return the contents of a bundled file, read once per process.
+    """
+
+    def load():
+        with open(path, "rb") as asset_fp:
+            return asset_fp.read()
+
+    return registry.get(("file", str(path)), load)
+
+
+def is_asset(value):
+    """
+    Return True if value is a buffer handed out by the registry, and so is
+    shared with other rows.
+    """
+    return registry.holds(value)
+
+
+def default_image():
+    """
+    Return the bytes of the default headshot (defaultimage.tiff).
+    """
+    return read_asset(DEFAULT_IMAGE_PATH)
+
+
+def processed_default_image(pipeline, crop, resize, engine=None):
+    """
+    Return the default headshot as pipeline processes it for a row with the
+    given crop and resize flags. Each variant is processed once per process,
+    on the crop engine (the shared one unless engine is given); if that
+    fails, the unprocessed image is used.
+    """
+    options = pipeline.cache_options(crop, resize)
+
+    def load():
+        img_data = default_image()
+        if not (crop or resize):
+            return img_data
+        [(processed, error)] = (engine or shared_engine()).map(
+            [(img_data, crop, resize, pipeline)]
+        )
+        if error is not None:
+            logger.info(f"Error processing the default image: {error}")
+            return img_data
+        return processed
+
+    return registry.get(("default_image", *sorted(options.items())), load)
@@ -0,0 +1,325 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+
+"""
+Multi-core image processing for cast lists.
+
+Face detection (dlib's CNN model) dominates build time on CPU-only machines,
+so rows are spread across a pool of worker processes. Each worker loads the
+detector model once, when it first crops an image (or when it starts, with
+preload), and keeps it for every row it handles. A row whose image cannot be
+processed reports an error for that row only, even if it crashes its worker
+process: the pool is replaced and the other rows are retried. Pipelines that
+detect faces in batches (detect_batch_size above 1) are handed several rows
+at a time.
+"""
+
+logger = logging.getLogger("util.engine")
+
+
+def default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class _RecordCollector(logging.Handler):
+    """
+    Collects the messages logged while a worker processes one row, so the
+    parent process can replay them into its own (per-task) log handlers.
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def preload_models():
+    """
+    Load the face detection models into this process. Importing
+    face_recognition loads dlib and its detector models, which takes
+    seconds, so long-running processes may prefer to do it before the first
+    row that needs cropping.
+    """
+    import face_recognition  # noqa: F401
+
+
+def _init_worker(preload=False):
+    if preload:
+        preload_models()
+    logging.getLogger("util").setLevel(logging.INFO)
+
+
+def process_image(img_data, crop, resize, pipeline=None):
+    """
+    Crop and/or resize a single image with an ImagePipeline. Returns a tuple
+    of (image bytes or None, error message or None, logged messages, timed
+    spans as (stage, seconds)).
+    """
+    from util import ImagePipeline
+
+    collector = _RecordCollector()
+    util_logger = logging.getLogger("util")
+    util_logger.addHandler(collector)
+    with metrics.collect() as spans:
+        try:
+            img_data = (pipeline or ImagePipeline()).process(
+                img_data, crop, resize
+            )
+            return img_data, None, collector.messages, spans
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            return None, error, collector.messages, spans
+        finally:
+            util_logger.removeHandler(collector)
+
+
+def process_batch(jobs):
+    """
+    Process (img_data, crop, resize, pipeline) jobs that share one pipeline
+    with ImagePipeline.process_batch, so their faces are detected together.
+    Returns a list of process_image results; the logged messages and spans
+    of the whole batch come with the first. If the batch fails as a whole
+    (e.g. detection raises), each job is retried on its own.
+    """
+    from util import ImagePipeline
+
+    pipeline = jobs[0][3] or ImagePipeline()
+    collector = _RecordCollector()
+    util_logger = logging.getLogger("util")
+    util_logger.addHandler(collector)
+    try:
+        with metrics.collect() as spans:
+            outcomes = pipeline.process_batch([job[:3] for job in jobs])
+    except Exception as e:
+        # Retry each job on its own, so only the images at fault fail.
+        logger.info(
+            f"Processing a batch of {len(jobs)} images failed "
+            f"({type(e).__name__}: {e}); processing them one at a time."
+        )
+        outcomes = None
+    finally:
+        util_logger.removeHandler(collector)
+    if outcomes is None:
+        results = [process_image(*job) for job in jobs]
+        results[0][2][:0] = collector.messages
+        return results
+    return [
+        (
+            (img_data, error, collector.messages, spans)
+            if index == 0
+            else (img_data, error, [], [])
+        )
+        for index, (img_data, error) in enumerate(outcomes)
+    ]
+
+
+def _process_jobs(jobs):
+    if len(jobs) == 1:
+        return [process_image(*jobs[0])]
+    return process_batch(jobs)
+
+
+class CropEngine:
+    """
+    A pool of worker processes that crop and resize images.
+
+    processes=0 runs everything in the calling process, which is useful when
+    debugging or when only a handful of rows need processing. With preload,
+    each worker loads the face detection models as soon as it starts rather
+    than when it first crops an image.
+    """
+
+    def __init__(self, processes=None, preload=False):
+        self.processes = default_workers() if processes is None else processes
+        self.preload = preload
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Use spawn rather than fork: the web app calls this from a
+                # thread, and forking a threaded process is unsafe.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.preload,),
+                )
+            return self._executor
+
+    @property
+    def busy(self):
+        """
+        The number of workers currently processing an image.
+        """
+        return min(self._in_flight, max(self.processes, 1))
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+
+    def warm(self):
+        """
+        Start every worker process now, so that they (and, with preload,
+        their models) are ready before the first job arrives. With
+        processes=0 the models are preloaded into the calling process.
+        """
+        if self.processes <= 0:
+            if self.preload:
+                preload_models()
+            return
+        pool = self._pool()
+        # The pool starts a worker for each job submitted while none is idle.
+        for future in [pool.submit(os.getpid) for _ in range(self.processes)]:
+            future.result()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _batches(self, jobs):
+        """
+        Split jobs into the units handed to a worker: single jobs, or, when
+        every job shares a pipeline that detects faces in batches, batches of
+        up to its detect_batch_size, small enough to keep every worker busy.
+        """
+        pipelines = {id(job[3]) for job in jobs}
+        batch_size = getattr(jobs[0][3], "detect_batch_size", 1)
+        if len(pipelines) > 1 or batch_size < 2:
+            return [[job] for job in jobs]
+        workers = max(self.processes, 1)
+        batch_size = max(1, min(batch_size, -(-len(jobs) // workers)))
+        return [
+            jobs[start : start + batch_size]
+            for start in range(0, len(jobs), batch_size)
+        ]
+
+    def _discard_pool(self, executor):
+        """
+        Drop a broken pool, so the next call starts a new one. Another
+        thread may already have replaced it, in which case the new pool is
+        kept.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_batches(self, batches):
+        """
+        Run batches on the pool, yielding (index, _process_jobs result) as
+        each finishes. If a worker dies (a native crash in dlib or Pillow,
+        or the OOM killer), the pool is replaced and the batches it did not
+        finish run again, one at a time, so only a batch that crashes its
+        worker a second time is reported as failed, one error per row.
+        """
+        finished = set()
+        pool = self._pool()
+        try:
+            futures = [pool.submit(_process_jobs, batch) for batch in batches]
+            for index, future in enumerate(futures):
+                yield index, future.result()
+                finished.add(index)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+        unfinished = [i for i in range(len(batches)) if i not in finished]
+        if unfinished:
+            logger.info(
+                f"An image worker crashed; retrying "
+                f"{sum(len(batches[i]) for i in unfinished)} image(s)."
+            )
+        for index in unfinished:
+            pool = self._pool()
+            try:
+                batch_results = pool.submit(
+                    _process_jobs, batches[index]
+                ).result()
+            except BrokenProcessPool as e:
+                self._discard_pool(pool)
+                error = f"{type(e).__name__}: the image worker crashed"
+                batch_results = [(None, error, [], [])] * len(batches[index])
+            yield index, batch_results
+
+    def map(self, jobs):
+        """
+        Process (img_data, crop, resize, pipeline) jobs and return a list of
+        (image bytes or None, error message or None) in the same order.
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        remaining = len(jobs)
+        self._track(remaining)
+        try:
+            batches = self._batches(jobs)
+            if self.processes <= 0:
+                # Messages and spans were already recorded in this process.
+                outcomes = map(_process_jobs, batches)
+                completed = enumerate(outcomes)
+            else:
+                completed = self._run_batches(batches)
+            results = [None] * len(batches)
+            for index, batch_results in completed:
+                results[index] = []
+                for img_data, error, messages, spans in batch_results:
+                    if self.processes > 0:
+                        for message in messages:
+                            logger.info(message)
+                        for stage, seconds in spans:
+                            metrics.record(stage, seconds)
+                    results[index].append((img_data, error))
+                remaining -= len(batch_results)
+                self._track(-len(batch_results))
+            return [result for batch in results for result in batch]
+        finally:
+            self._track(-remaining)
+
+
+_shared_engine = None
+_shared_lock = threading.Lock()
+
+
+def warm_start_enabled():
+    return os.environ.get("WAVETOOL_WARM_START", "0").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+
+def shared_engine():
+    """
+    Return a process-wide CropEngine, so long-running callers such as the web
+    app keep their warm workers (and loaded models) between jobs. The
+    WAVETOOL_CROP_WORKERS environment variable overrides the pool size, and
+    WAVETOOL_WARM_START=1 makes its workers preload the detection models.
+    """
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            processes = os.environ.get("WAVETOOL_CROP_WORKERS")
+            _shared_engine = CropEngine(
+                int(processes) if processes else None,
+                preload=warm_start_enabled(),
+            )
+        return _shared_engine
@@ -0,0 +1,221 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from metrics import span
+
+"""
+Concurrent image acquisition for cast lists.
+
+Every row's image source (a URL or a local path) is resolved up front by a
+bounded pool of workers sharing a single pooled HTTP session, so a long cast
+list spends its time downloading in parallel rather than one image at a time.
+"""
+
+logger = logging.getLogger("util.fetch")
+
+URL_PATTERN = re.compile(r"^(http|https)://")
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+# (connect, read) timeouts in seconds.
+DEFAULT_TIMEOUT = (5, 30)
+DEFAULT_RETRIES = 3
+
+
+def is_url(source):
+    return bool(source) and URL_PATTERN.match(source) is not None
+
+
+def make_session(pool_size=DEFAULT_WORKERS, retries=DEFAULT_RETRIES):
+    """
+    Create a requests session with a connection pool large enough for
+    pool_size concurrent workers and automatic retries (with backoff) on
+    connection errors and transient HTTP status codes.
+    """
+    # Imported here so that cast lists of local files never load requests.
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ImageFetcher:
+    """
+    Resolve image sources to bytes using a bounded pool of worker threads.
+
+    URLs are downloaded through a shared session with at most per_host
+    requests in flight to any one host; anything else is treated as a path,
+    first as given and then relative to castlist_path. Sources that cannot be
+    fetched resolve to None so the caller can substitute a default image.
+    """
+
+    def __init__(
+        self,
+        castlist_path,
+        session=None,
+        max_workers=DEFAULT_WORKERS,
+        per_host=DEFAULT_PER_HOST,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.castlist_path = castlist_path
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self._owns_session = session is None
+        self.session = session or make_session(pool_size=self.max_workers)
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._host_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(
+                    self.per_host
+                )
+            return self._host_limits[host]
+
+    def _download(self, url):
+        logger.info(f"  Downloading image from {url}...")
+        try:
+            with self._host_semaphore(url):
+                r = self.session.get(url, timeout=self.timeout)
+            if r.ok:
+                logger.info(f"Success! ({url})")
+                return r.content
+            logger.info(f"Failed! ({url}: HTTP {r.status_code})")
+        except Exception as e:
+            logger.info(f"Failed! ({url}: {e})")
+        return None
+
+    def _read_file(self, source):
+        image_path = source
+        if not os.path.exists(image_path) and self.castlist_path is not None:
+            image_path = os.path.join(self.castlist_path, source)
+        try:
+            with open(image_path, "rb") as img_fp:
+                return img_fp.read()
+        except IOError:
+            logger.info(f"Could not read image file {source}")
+            return None
+
+    def fetch(self, source):
+        """
+        Fetch a single image source. Returns the raw bytes, or None if the
+        source is empty or could not be fetched.
+        """
+        if not source:
+            return None
+        with span("fetch"):
+            if is_url(source):
+                return self._download(source)
+            return self._read_file(source)
+
+    def _validator(self, url):
+        """
+        Return the ETag or Last-Modified header the server sends for url, or
+        None if it sends neither (or the request fails).
+        """
+        try:
+            with self._host_semaphore(url):
+                r = self.session.head(
+                    url, timeout=self.timeout, allow_redirects=True
+                )
+        except Exception:
+            return None
+        if not r.ok:
+            return None
+        for header in ("ETag", "Last-Modified"):
+            if r.headers.get(header):
+                return f"{header}: {r.headers[header]}"
+        return None
+
+    def fingerprint(self, source):
+        """
+        Identify the current content of a source, for incremental builds.
+        Returns (fingerprint, data): URLs whose server sends an ETag or
+        Last-Modified header are identified by it without being downloaded
+        and data is None; anything else is fetched and identified by a hash
+        of its bytes, which are returned as data so they need not be fetched
+        again. The fingerprint is None if the source could not be fetched.
+        """
+        if not source:
+            return "", None
+        if is_url(source):
+            validator = self._validator(source)
+            if validator is not None:
+                return f"{source} {validator}", None
+        data = self.fetch(source)
+        if data is None:
+            return None, None
+        return hashlib.sha256(data).hexdigest(), data
+
+    def _map(self, func, sources):
+        sources = list(sources)
+        if not sources:
+            return []
+        workers = min(self.max_workers, len(sources))
+        # Run each call in a copy of the caller's context so that context
+        # variables (such as the web app's current task, used to route log
+        # records) carry over to the worker threads.
+        context = contextvars.copy_context()
+
+        def run_in_context(source):
+            return context.copy().run(func, source)
+
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="fetch"
+        ) as executor:
+            return list(executor.map(run_in_context, sources))
+
+    def fetch_all(self, sources):
+        """
+        Fetch every source concurrently and return the results as a list in
+        the same order as sources.
+        """
+        return self._map(self.fetch, sources)
+
+    def fingerprint_all(self, sources):
+        """
+        Fingerprint every source concurrently (see fingerprint) and return
+        the results as a list in the same order as sources.
+        """
+        return self._map(self.fingerprint, sources)
+
+
+def fetch_images(sources, castlist_path, **kwargs):
+    """
+    Convenience wrapper: fetch all sources with a temporary ImageFetcher and
+    return the results in order. Keyword arguments are passed to ImageFetcher.
+    """
+    with ImageFetcher(castlist_path, **kwargs) as fetcher:
+        return fetcher.fetch_all(sources)
@@ -0,0 +1,23 @@
+"""
+gunicorn settings for the web app. gunicorn reads this file when started
+from this directory:
+
+    gunicorn app:app
+
+Each worker process starts its own job workers and retention sweeper once
+it has forked (see app.start_services); the app module does not start them
+on import. The settings are checked once in the master before any worker
+starts, so a bad setting stops gunicorn instead of every worker.
+"""
+
+
+def on_starting(server):
+    import app
+
+    app.check_config()
+
+
+def post_fork(server, worker):
+    import app
+
+    app.start_services()
@@ -0,0 +1,151 @@
+import os
+import hashlib
+import logging
+import pathlib
+import tempfile
+import threading
+
+"""
+Content-addressed on-disk cache of processed headshots.
+
+Entries are keyed by a hash of the source image bytes plus the processing
+options (crop, resize, ...) and hold the final image bytes, so regenerating an
+unchanged cast list skips decoding, face detection and encoding entirely.
+The cache is bounded by a byte budget and evicts least recently used entries.
+"""
+
+logger = logging.getLogger("util.cache")
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "wavetool_utilities", "images"
+)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def cache_key(source, **options):
+    """
+    Return the cache key for source bytes processed with the given options.
+    """
+    digest = hashlib.sha256(source)
+    for name in sorted(options):
+        digest.update(f"\0{name}={options[name]!r}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """
+    A directory of processed images named by their cache key.
+
+    Least-recently-used order is tracked through file modification times (a
+    hit touches the entry), so it survives restarts and is shared between
+    every process pointing at the same directory.
+    """
+
+    def __init__(
+        self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES
+    ):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.img"
+
+    def _entries(self):
+        for path in self.directory.glob("*/*.img"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, stat
+
+    def size(self):
+        """
+        Total size in bytes of all cached entries.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._entries())
+            return self._size
+
+    def get(self, key):
+        """
+        Return the cached bytes for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """
+        Store data under key, then evict old entries if over budget.
+        """
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file and rename so readers in other processes
+        # never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        current = self.size()
+        with self._lock:
+            self._size = current + len(data)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its budget.
+        Returns the number of bytes reclaimed.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+            total = sum(stat.st_size for _, stat in entries)
+            reclaimed = 0
+            for path, stat in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= stat.st_size
+                reclaimed += stat.st_size
+            self._size = total
+        if reclaimed:
+            logger.info(f"Image cache evicted {reclaimed} bytes.")
+        return reclaimed
+
+
+def default_cache():
+    """
+    Return an ImageCache for the directory shared by the command line scripts
+    and the web app. WAVETOOL_CACHE_DIR and WAVETOOL_CACHE_MAX_BYTES override
+    the location and size budget; WAVETOOL_CACHE_DIR="" disables caching.
+    """
+    directory = os.environ.get("WAVETOOL_CACHE_DIR", DEFAULT_CACHE_DIR)
+    if not directory:
+        return None
+    max_bytes = int(
+        os.environ.get("WAVETOOL_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+    )
+    return ImageCache(os.path.expanduser(directory), max_bytes)
@@ -0,0 +1,265 @@
+import os
+import json
+import hashlib
+import logging
+import pathlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+"""
+Incremental rebuilds of cast list outputs.
+
+A build directory kept next to the outputs records, for every row of the last
+build, a fingerprint of the row's inputs (its text fields, flags, the image
+processing options and a fingerprint of the image source) together with the
+processed image it produced, and optionally the rendered mic card page for
+each entry. On the next build only rows whose fingerprint changed are fetched
+and processed again; everything else is reused from the build directory.
+
+Page reuse is off by default: merging hundreds of one page PDFs with pypdf
+is slower than rendering the deck again in one document, so it only pays
+off when rendering is the expensive part (e.g. a vector background on a slow
+machine). Images are always reused.
+
+    <output>.build/
+        manifest.json
+        images/<row fingerprint>.img
+        pages/<card key>.pdf
+"""
+
+logger = logging.getLogger("util.incremental")
+
+MANIFEST_VERSION = 1
+
+# Row fields that affect the processed image or the output entry.
+ROW_FIELDS = (
+    "real_name",
+    "character",
+    "comments",
+    "channel",
+    "crop",
+    "resize",
+)
+
+
+def build_dir_for(output_file):
+    """
+    Return the build directory used for incremental builds of output_file.
+    """
+    return pathlib.Path(f"{output_file}.build")
+
+
+def row_fingerprint(row, source_fingerprint, options):
+    """
+    Hash a cast list row's inputs: its fields, the fingerprint of its image
+    source and the image processing options (see ImagePipeline.cache_options).
+    """
+    digest = hashlib.sha256()
+    for name in ROW_FIELDS:
+        digest.update(f"{name}={row.get(name)!r}\0".encode())
+    digest.update(f"image={source_fingerprint!r}\0".encode())
+    for name in sorted(options):
+        digest.update(f"{name}={options[name]!r}\0".encode())
+    return digest.hexdigest()
+
+
+def card_key(entry, img_data, style=""):
+    """
+    Hash everything that appears on an entry's mic card page; style names
+    any rendering option that changes the page.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"style={style!r}\0".encode())
+    for name in ("Channel", "RoleName", "Name", "Comments"):
+        digest.update(f"{name}={entry.get(name)!r}\0".encode())
+    digest.update(hashlib.sha256(img_data).digest())
+    return digest.hexdigest()
+
+
+def lock_if_idle(directory):
+    """
+    Lock a build directory if no build has it open, and return the open
+    lock file (close it to release the lock), or None if a build holds it.
+    """
+    try:
+        lock_fp = open(pathlib.Path(directory) / ".lock", "w")
+    except FileNotFoundError:
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_fp.close()
+            return None
+    return lock_fp
+
+
+class IncrementalBuild:
+    """
+    A build directory holding the manifest, processed images and rendered
+    pages of the previous build.
+
+    Use as a context manager: the directory is locked against concurrent
+    builds while open, and on a successful exit the manifest is rewritten to
+    list what this build used and anything it did not use is removed.
+    Rendered pages are only reused and stored with reuse_pages. The get_ and
+    put_ methods may be called from several threads at once.
+    """
+
+    def __init__(self, directory, reuse_pages=False):
+        self.directory = pathlib.Path(directory)
+        self.reuse_pages = reuse_pages
+        self.images_dir = self.directory / "images"
+        self.pages_dir = self.directory / "pages"
+        self.manifest_path = self.directory / "manifest.json"
+        self.rows = set()
+        self.pages = set()
+        self.reused_rows = 0
+        self.reused_pages = 0
+        self._used_rows = set()
+        self._used_pages = set()
+        self._lock = threading.Lock()
+        self._lock_fp = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self.save()
+        finally:
+            self.close()
+
+    def open(self):
+        lock_path = self.directory / ".lock"
+        while True:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._lock_fp = open(lock_path, "w")
+            if fcntl is None:
+                break
+            fcntl.flock(self._lock_fp, fcntl.LOCK_EX)
+            # The retention sweeper may have removed the directory while we
+            # waited for the lock; if so, start again in a new one.
+            locked_inode = os.fstat(self._lock_fp.fileno()).st_ino
+            try:
+                if os.stat(lock_path).st_ino == locked_inode:
+                    break
+            except FileNotFoundError:
+                pass
+            self.close()
+        self.images_dir.mkdir(exist_ok=True)
+        self.pages_dir.mkdir(exist_ok=True)
+        try:
+            with open(self.manifest_path) as fp:
+                manifest = json.load(fp)
+            # Mark the build as in use for the retention sweeper.
+            os.utime(self.manifest_path)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        if manifest.get("version") == MANIFEST_VERSION:
+            self.rows = set(manifest.get("rows", []))
+            self.pages = set(manifest.get("pages", []))
+
+    def close(self):
+        if self._lock_fp is not None:
+            self._lock_fp.close()
+            self._lock_fp = None
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get_image(self, fingerprint):
+        """
+        Return the processed image of an unchanged row, or None.
+        """
+        if fingerprint not in self.rows:
+            return None
+        data = self._read(self.images_dir / f"{fingerprint}.img")
+        if data is not None:
+            with self._lock:
+                self._used_rows.add(fingerprint)
+                self.reused_rows += 1
+        return data
+
+    def put_image(self, fingerprint, img_data):
+        self._write(self.images_dir / f"{fingerprint}.img", img_data)
+        with self._lock:
+            self._used_rows.add(fingerprint)
+
+    def get_page(self, key):
+        """
+        Return the rendered page for a card key as PDF bytes, or None.
+        """
+        if not self.reuse_pages or key not in self.pages:
+            return None
+        data = self._read(self.pages_dir / f"{key}.pdf")
+        if data is not None:
+            with self._lock:
+                self._used_pages.add(key)
+                self.reused_pages += 1
+        return data
+
+    def put_page(self, key, pdf_data):
+        if not self.reuse_pages:
+            return
+        self._write(self.pages_dir / f"{key}.pdf", pdf_data)
+        with self._lock:
+            self._used_pages.add(key)
+
+    def save(self):
+        """
+        Write the manifest for this build and remove the images and pages
+        that it no longer uses. Pages are only pruned if any were used, so a
+        build that wrote no PDF keeps the previous build's pages.
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        pages = self._used_pages or self.pages
+        self._write(
+            self.manifest_path,
+            json.dumps(
+                {
+                    "version": MANIFEST_VERSION,
+                    "rows": sorted(self._used_rows),
+                    "pages": sorted(pages),
+                }
+            ).encode(),
+        )
+        for directory, used, suffix in (
+            (self.images_dir, self._used_rows, ".img"),
+            (self.pages_dir, pages, ".pdf"),
+        ):
+            for path in directory.iterdir():
+                if path.suffix == suffix and path.stem not in used:
+                    path.unlink(missing_ok=True)
+        self.rows = set(self._used_rows)
+        self.pages = set(pages)
+        logger.info(
+            f"Incremental build: reused {self.reused_rows} images and "
+            f"{self.reused_pages} pages."
+        )
@@ -0,0 +1,457 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+"""
+Persistent job queue for the web app.
+
+Jobs and their log lines live in a local SQLite database, so status survives
+restarts and is visible to every gunicorn worker process sharing the file.
+Each process runs a small pool of worker threads that claim queued jobs from
+the database; a job is only claimed while fewer than max_running jobs are
+processing across all processes, which bounds CPU use however many uploads
+arrive at once.
+"""
+
+logger = logging.getLogger("jobs")
+
+QUEUED = "queued"
+PROCESSING = "processing"
+COMPLETED = "completed"
+ERROR = "error"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    input_source TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    pid INTEGER,
+    owner TEXT,
+    pla TEXT,
+    pdf TEXT,
+    error TEXT,
+    progress_done INTEGER NOT NULL DEFAULT 0,
+    progress_total INTEGER,
+    accessed REAL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_job ON logs (job_id, id);
+"""
+
+# Columns added since the first schema, with their definitions, so existing
+# databases can be upgraded in place.
+ADDED_COLUMNS = {
+    "progress_done": "INTEGER NOT NULL DEFAULT 0",
+    "progress_total": "INTEGER",
+    "accessed": "REAL",
+    "timings": "TEXT",
+    "owner": "TEXT",
+}
+
+# Columns that callers may set through JobStore.update().
+UPDATABLE = {
+    "status",
+    "started",
+    "finished",
+    "pid",
+    "pla",
+    "pdf",
+    "error",
+    "progress_done",
+    "progress_total",
+    "timings",
+}
+
+# Log lines kept per job; older lines are discarded as new ones arrive.
+DEFAULT_MAX_LOG_LINES = 2000
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobStore.create() when the queue already holds max_queued jobs.
+    """
+
+    def __init__(self, queued):
+        super().__init__(f"The job queue is full ({queued} jobs waiting).")
+        self.queued = queued
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_token(pid):
+    """
+    Identify a process by its pid and start time (from /proc), so that a
+    later process reusing the pid does not match. Without /proc, or once the
+    process has exited, this is just the pid.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            # starttime is the 22nd field, the 20th after the command name.
+            start = fp.read().rpartition(")")[2].split()[19]
+    except (OSError, IndexError):
+        return str(pid)
+    return f"{pid}:{start}"
+
+
+def _owner_alive(pid, owner):
+    """
+    Return whether the process that claimed a job (its pid and the token
+    recorded by claim) is still running.
+    """
+    if owner is not None and ":" in owner:
+        return _process_token(pid) == owner
+    # No start time was recorded: go by the pid alone. Our own pid can only
+    # appear here if it was reused from a process that died, since orphans
+    # are requeued before we claim anything.
+    return pid != os.getpid() and _pid_alive(pid)
+
+
+class JobStore:
+    """
+    Job state in a SQLite database. A new connection is opened for each
+    operation, so a store can be shared freely between threads.
+    """
+
+    def __init__(self, path, max_log_lines=DEFAULT_MAX_LOG_LINES):
+        self.path = str(path)
+        self.max_log_lines = max_log_lines
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {
+                row["name"] for row in conn.execute("PRAGMA table_info(jobs)")
+            }
+            for name, definition in ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(
+                        f"ALTER TABLE jobs ADD COLUMN {name} {definition}"
+                    )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Connection(conn)
+
+    def create(self, job_id, input_source, max_queued=None):
+        """
+        Queue a new job and return its position in the queue (1 = next).
+        Raises QueueFull if max_queued jobs are already waiting.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+            if max_queued is not None and queued >= max_queued:
+                conn.execute("ROLLBACK")
+                raise QueueFull(queued)
+            conn.execute(
+                "INSERT INTO jobs (id, status, input_source, created) "
+                "VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, input_source, time.time()),
+            )
+            conn.execute("COMMIT")
+        return queued + 1
+
+    def claim(self, max_running):
+        """
+        Atomically move the oldest queued job to processing, provided fewer
+        than max_running jobs are processing. Returns the job as a dict, or
+        None if there is nothing to do.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            running = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (PROCESSING,)
+            ).fetchone()[0]
+            row = None
+            if running < max_running:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? "
+                    "ORDER BY created LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            pid = os.getpid()
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = ?, pid = ?, owner = ? "
+                "WHERE id = ?",
+                (PROCESSING, time.time(), pid, _process_token(pid), row["id"]),
+            )
+            conn.execute("COMMIT")
+        return dict(row, status=PROCESSING)
+
+    def update(self, job_id, **fields):
+        unknown = set(fields) - UPDATABLE
+        if unknown:
+            raise ValueError(f"Cannot update job fields: {sorted(unknown)}")
+        if not fields:
+            return
+        if "timings" in fields:
+            # Seconds spent in each stage, as recorded by metrics.JobTimings.
+            fields["timings"] = json.dumps(fields["timings"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def append_log(self, job_id, message):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "INSERT INTO logs (job_id, message) VALUES (?, ?)",
+                (job_id, message),
+            )
+            # Log ids are global, so trim by the job's max_log_lines-th
+            # newest line rather than by arithmetic on the new id.
+            conn.execute(
+                "DELETE FROM logs WHERE job_id = ? AND id <= ("
+                "SELECT id FROM logs WHERE job_id = ? "
+                "ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (job_id, job_id, self.max_log_lines),
+            )
+            conn.execute("COMMIT")
+        return cursor.lastrowid
+
+    def get_logs(self, job_id, cursor=0, limit=500):
+        """
+        Return (lines, cursor) for up to limit log lines logged after cursor.
+        Pass the returned cursor back in to receive only newer lines.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, message FROM logs WHERE job_id = ? AND id > ? "
+                "ORDER BY id LIMIT ?",
+                (job_id, cursor, limit),
+            ).fetchall()
+        if rows:
+            cursor = rows[-1]["id"]
+        return [row["message"] for row in rows], cursor
+
+    def exists(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, job_id, include_logs=True):
+        """
+        Return the job's public state (status, progress, outputs, error, logs
+        and, for queued jobs, queue position) as a dict, or None if it does
+        not exist.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = {
+                "status": row["status"],
+                "progress": {
+                    "done": row["progress_done"],
+                    "total": row["progress_total"],
+                },
+            }
+            for name in ("pla", "pdf", "error"):
+                if row[name] is not None:
+                    job[name] = row[name]
+            if row["timings"] is not None:
+                job["timings"] = json.loads(row["timings"])
+            if row["status"] == QUEUED:
+                job["queue_position"] = (
+                    conn.execute(
+                        "SELECT COUNT(*) FROM jobs "
+                        "WHERE status = ? AND created < ?",
+                        (QUEUED, row["created"]),
+                    ).fetchone()[0]
+                    + 1
+                )
+            if include_logs:
+                job["logs"] = [
+                    log["message"]
+                    for log in conn.execute(
+                        "SELECT message FROM logs WHERE job_id = ? "
+                        "ORDER BY id",
+                        (job_id,),
+                    )
+                ]
+        return job
+
+    def counts(self):
+        """
+        Return the number of jobs in each status.
+        """
+        with self._connect() as conn:
+            return {
+                row["status"]: row["n"]
+                for row in conn.execute(
+                    "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+                )
+            }
+
+    def touch(self, job_id):
+        """
+        Record that a job's results were used, for least-recently-used
+        eviction of finished jobs.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET accessed = ? WHERE id = ?",
+                (time.time(), job_id),
+            )
+
+    def evict_finished(self, keep):
+        """
+        Delete all but the keep most recently used finished jobs (and their
+        logs). Returns the evicted jobs as dicts with id, pla and pdf, so the
+        caller can remove their output files.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, pla, pdf FROM jobs WHERE status IN (?, ?) "
+                "ORDER BY COALESCE(accessed, finished, created) DESC "
+                "LIMIT -1 OFFSET ?",
+                (COMPLETED, ERROR, keep),
+            ).fetchall()
+            for row in rows:
+                conn.execute("DELETE FROM logs WHERE job_id = ?", (row["id"],))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+            conn.execute("COMMIT")
+        return [dict(row) for row in rows]
+
+    def requeue_orphans(self):
+        """
+        Put processing jobs whose worker process no longer exists (e.g. after
+        a restart) back on the queue. A job's process is recognised by its
+        pid and start time, so a pid reused since does not keep the job.
+        Returns the number requeued.
+        """
+        requeued = 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, pid, owner FROM jobs WHERE status = ?",
+                (PROCESSING,),
+            ).fetchall()
+            for row in rows:
+                pid = row["pid"]
+                if pid is not None and _owner_alive(pid, row["owner"]):
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, pid = NULL, owner = NULL, "
+                    "progress_done = 0 WHERE id = ? AND status = ?",
+                    (QUEUED, row["id"], PROCESSING),
+                )
+                conn.execute("DELETE FROM logs WHERE job_id = ?", (row["id"],))
+                requeued += 1
+        if requeued:
+            logger.warning(f"Requeued {requeued} interrupted job(s).")
+        return requeued
+
+
+class _Connection:
+    """
+    Context manager that closes a sqlite3 connection on exit (the sqlite3
+    connection's own context manager only ends the transaction).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+class JobQueue:
+    """
+    A bounded pool of worker threads that run queued jobs from a JobStore.
+
+    runner(job_id, input_source) does the work and records the outcome in the
+    store; an exception escaping it marks the job as failed.
+    """
+
+    def __init__(self, store, runner, max_running=2, poll_interval=1.0):
+        self.store = store
+        self.runner = runner
+        self.max_running = max(1, max_running)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.busy = 0
+
+    def start(self):
+        """
+        Requeue interrupted jobs and start the worker threads (once).
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self.store.requeue_orphans()
+            for i in range(self.max_running):
+                thread = threading.Thread(
+                    target=self._work, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """
+        Wake the workers, e.g. after a job has been queued.
+        """
+        self._wakeup.set()
+
+    def _work(self):
+        while True:
+            try:
+                job = self.store.claim(self.max_running)
+            except sqlite3.Error:
+                logger.exception("Could not claim a job.")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self._lock:
+                self.busy += 1
+            try:
+                self.runner(job["id"], job["input_source"])
+            except Exception as e:
+                logger.exception(f"Job {job['id']} failed.")
+                self.store.update(
+                    job["id"], status=ERROR, error=str(e), finished=time.time()
+                )
+            finally:
+                with self._lock:
+                    self.busy -= 1
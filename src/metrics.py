@@ -0,0 +1,204 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+"""
+Timing of the stages of a build.
+
+Code that does a unit of work wraps it in span(stage). Each span is added to
+a process-wide histogram for its stage and, while current_job holds a
+JobTimings, to that job's totals, which the web app reports in the job's
+status. Crop workers run in other processes, so they collect their spans and
+send them back with each image for the parent to record (see
+crop_engine.process_image). A span costs two perf_counter() calls and a
+couple of lock acquisitions.
+
+prometheus_text() renders the histograms, plus any gauges the caller
+supplies, in the Prometheus text exposition format. Histograms are per
+process: behind several gunicorn workers each scrape sees one worker's.
+"""
+
+# Stages that are timed: per row, then per output file.
+STAGES = (
+    "fetch",
+    "decode",
+    "detect",
+    "crop",
+    "resize",
+    "encode",
+    "pla_write",
+    "pdf_write",
+)
+
+# Histogram bucket upper bounds, in seconds.
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """
+    A cumulative histogram of observed durations, Prometheus style.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Return ([(upper bound, cumulative count), ...], sum, count); the last
+        bound is infinity.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total, running
+
+
+class JobTimings:
+    """
+    The number of spans and total seconds spent in each stage by one job.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            count, total = self._stages.get(stage, (0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                stage: {"count": count, "seconds": round(total, 4)}
+                for stage, (count, total) in self._stages.items()
+            }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+# The timings of the job running in the current context. Fetch threads run
+# in a copy of the job's context, so their spans count towards it too.
+current_job = contextvars.ContextVar("current_job", default=None)
+
+_local = threading.local()
+
+
+def histogram(stage):
+    with _histograms_lock:
+        if stage not in _histograms:
+            _histograms[stage] = Histogram()
+        return _histograms[stage]
+
+
+def record(stage, seconds):
+    """
+    Record that a stage took seconds.
+    """
+    histogram(stage).observe(seconds)
+    timings = current_job.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the body of a with statement, or each call of a function it
+    decorates, as a stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    """
+    Also collect the spans this thread records into a list of (stage,
+    seconds), to pass them to another process to record.
+    """
+    previous = getattr(_local, "spans", None)
+    _local.spans = spans = []
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def prometheus_text(gauges=()):
+    """
+    Render the stage histograms and gauges, given as (name, help, {labels
+    tuple: value}) with labels as ((name, value), ...), in the Prometheus
+    text format.
+    """
+    lines = [
+        "# HELP wavetool_stage_seconds Time spent in each build stage.",
+        "# TYPE wavetool_stage_seconds histogram",
+    ]
+    # Every stage is listed, even before its first span.
+    for stage in STAGES:
+        histogram(stage)
+    with _histograms_lock:
+        stages = sorted(_histograms.items())
+    for stage, stage_histogram in stages:
+        buckets, total, count = stage_histogram.snapshot()
+        for bound, cumulative in buckets:
+            lines.append(
+                f'wavetool_stage_seconds_bucket{{stage="{stage}",'
+                f'le="{_format_bound(bound)}"}} {cumulative}'
+            )
+        lines.append(f'wavetool_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(
+            f'wavetool_stage_seconds_count{{stage="{stage}"}} {count}'
+        )
+    for name, help_text, values in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in values.items():
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            if label_text:
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,12 +1,21 @@
 import os
-import sys
-import pathlib
-import traceback
+import logging
 import re
-import requests
+import zipfile
+import multiprocessing
+from io import BytesIO
+from itertools import islice
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
-from util import crop_image, resize_image, import_castlist, build_castlist
+from fpdf.svg import SVGObject
+from util import image_bytes, DEFAULT_CHUNK_SIZE
+from incremental import card_key
+from crop_engine import default_workers
+from assets import registry, read_asset, BACKGROUND_PATH
+from metrics import span
 
 """
 This script converts a CSV of a cast list with optional comments and images
@@ -14,81 +23,418 @@ into a PDF of mic cards.
 """
 
 
-def create_mic_cards(wavetool_castlist, output_file, castlist_path):
-    pdf = FPDF(format="A4")
+logger = logging.getLogger("util.mic_cards")
+
+# Resolution of the rasterised background (WAVETOOL_PDF_BACKGROUND=raster).
+BACKGROUND_DPI = 200
+
+
+def _load_background(width, height, raster):
+    svg_data = read_asset(BACKGROUND_PATH)
+    if raster:
+        try:
+            from vips_backend import rasterize_svg
+
+            return rasterize_svg(svg_data, BACKGROUND_DPI)
+        except Exception as e:
+            logger.warning(
+                f"Could not rasterise the card background ({e}); "
+                "drawing it as vectors instead."
+            )
+    svg = SVGObject(svg_data)
+    _, _, path = svg.transform_to_rect_viewport(
+        scale=1, width=width, height=height, ignore_svg_top_attrs=True
+    )
+    return path
+
+
+def page_background(width, height, raster=False):
+    """
+    Return the card background for pages of width x height, prepared once
+    per process: with raster, PNG bytes of pdfbg.svg rendered by libvips
+    (embedded once in each PDF and referenced by every page); otherwise, or
+    if libvips cannot render it, the SVG's drawing as an fpdf path, parsed
+    once rather than on every page.
+    """
+    return registry.get(
+        ("background", width, height, raster),
+        lambda: _load_background(width, height, raster),
+    )
+
+
+class CardPDF(FPDF):
+    """
+    FPDF that draws the card background on each page. A vector background
+    is rendered to PDF operators on the first page only, and those operators
+    are repeated on later pages instead of rendering the drawing again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._background_ops = None
+
+    def draw_background(self, background):
+        if isinstance(background, bytes):
+            self.image(background, x=0, y=0, w=self.w, h=self.h)
+            return
+        if self._background_ops is not None:
+            for ops in self._background_ops:
+                self._out(ops)
+            return
+        captured = []
+        out = self._out
+
+        def capture(ops):
+            captured.append(ops)
+            out(ops)
+
+        # Paths are drawn relative to the current position.
+        x, y = self.x, self.y
+        self.set_xy(0, 0)
+        self._out = capture
+        try:
+            self.draw_path(background)
+        finally:
+            del self._out
+            self.set_xy(x, y)
+        self._background_ops = captured
+
+
+def _new_pdf():
+    pdf = CardPDF(format="A4")
     pdf.set_top_margin(25)
     pdf.set_left_margin(25)
     pdf.set_right_margin(25)
-    bg_path = os.path.join(
-        str(pathlib.Path(__file__).parent.resolve()), "../pdfbg.svg"
+    return pdf
+
+
+def _add_card(pdf, character, raster_background=False):
+    pdf.add_page()
+    pdf.draw_background(page_background(pdf.w, pdf.h, raster_background))
+    pdf.set_font("helvetica", "B", 12)
+    pdf.cell(
+        0,
+        10,
+        text=f"Channel {character['Channel']}",
+        new_y=YPos.NEXT,
+        new_x=XPos.LMARGIN,
+        align="R",
+    )
+    pdf.set_font("helvetica", "B", 24)
+    pdf.cell(
+        0,
+        10,
+        text=character["RoleName"],
+        new_x=XPos.LMARGIN,
+        new_y=YPos.NEXT,
+        align="C",
+    )
+    pdf.set_font("helvetica", "", 12)
+    pdf.cell(
+        0,
+        10,
+        text=character["Name"],
+        new_x=XPos.LMARGIN,
+        new_y=YPos.NEXT,
+        align="C",
+    )
+    pdf.cell(
+        0,
+        10,
+        text=character["Comments"],
+        new_x=XPos.LMARGIN,
+        new_y=YPos.NEXT,
+        align="C",
     )
-    pdf.set_page_background(bg_path)
-    for character in wavetool_castlist:
-        pdf.add_page()
-        pdf.set_font("helvetica", "B", 12)
-        pdf.cell(
-            0,
-            10,
-            text=f"Channel {character['Channel']}",
-            new_y=YPos.NEXT,
-            new_x=XPos.LMARGIN,
-            align="R",
-        )
-        pdf.set_font("helvetica", "B", 24)
-        pdf.cell(
-            0,
-            10,
-            text=character["RoleName"],
-            new_x=XPos.LMARGIN,
-            new_y=YPos.NEXT,
-            align="C",
-        )
-        pdf.set_font("helvetica", "", 12)
-        pdf.cell(
-            0,
-            10,
-            text=character["Name"],
-            new_x=XPos.LMARGIN,
-            new_y=YPos.NEXT,
-            align="C",
-        )
-        pdf.cell(
-            0,
-            10,
-            text=character["Comments"],
-            new_x=XPos.LMARGIN,
-            new_y=YPos.NEXT,
-            align="C",
-        )
-        box = 75
-        pdf.image(
-            character["Image"],
-            w=box,
-            h=box,
-            x=pdf.w / 2 - box / 2,
-            keep_aspect_ratio=True,
-        )
-    pdf.output(output_file)
+    box = 75
+    # fpdf embeds identical image bytes only once, and copies JPEGs into
+    # the PDF as they are rather than re-encoding them.
+    pdf.image(
+        image_bytes(character["Image"]),
+        w=box,
+        h=box,
+        x=pdf.w / 2 - box / 2,
+        keep_aspect_ratio=True,
+    )
+
+
+def _raster_background_default():
+    return os.environ.get("WAVETOOL_PDF_BACKGROUND", "vector") == "raster"
+
+
+def _chunk_size_default():
+    return int(os.environ.get("WAVETOOL_PDF_CHUNK_SIZE", 0))
+
+
+def render_card(character, raster_background=None):
+    """
+    Render a single mic card as a one page PDF and return its bytes.
+    """
+    return render_cards([character], raster_background)
+
+
+def render_cards(characters, raster_background=None):
+    """
+    Render mic cards as one PDF and return its bytes.
+    """
+    if raster_background is None:
+        raster_background = _raster_background_default()
+    pdf = _new_pdf()
+    for character in characters:
+        _add_card(pdf, character, raster_background)
+    return bytes(pdf.output())
+
+
+def _render_chunk(job):
+    characters, raster_background, separate = job
+    if separate:
+        return [render_card(c, raster_background) for c in characters]
+    return render_cards(characters, raster_background)
+
+
+@contextmanager
+def _render_pool(processes):
+    """
+    Yield a pool of processes workers for _map_chunks, or None to render in
+    this process if processes is 0. Workers import fpdf and prepare the
+    background once, so a pool is kept for a whole deck.
+    """
+    if processes <= 0:
+        yield None
+        return
+    # Spawn rather than fork: the web app calls this from a thread.
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        yield executor
+
+
+def _map_chunks(jobs, executor, processes):
+    """
+    Yield _render_chunk(job) for each job, in order, rendering chunks in
+    executor's processes worker processes (or in this process if executor is
+    None). Only a few chunks per worker are in flight at a time.
+    """
+    if executor is None:
+        yield from map(_render_chunk, jobs)
+        return
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(_render_chunk, job))
+        if len(pending) >= 2 * processes:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_card_pdfs(
+    wavetool_castlist,
+    incremental=None,
+    raster_background=None,
+    chunk_size=None,
+    processes=None,
+):
+    """
+    Yield (entry, PDF bytes) with a one page PDF for each entry, in order.
+    Pages are reused from an open incremental.IncrementalBuild if given and
+    it reuses pages; the others are rendered chunk_size cards at a time on processes worker
+    processes when chunk_size is set (see create_mic_cards).
+    """
+    if raster_background is None:
+        raster_background = _raster_background_default()
+    if chunk_size is None:
+        chunk_size = _chunk_size_default()
+    if incremental is not None and not incremental.reuse_pages:
+        incremental = None
+    if not chunk_size:
+        processes = 0
+    elif processes is None:
+        processes = default_workers()
+    style = "raster" if raster_background else "vector"
+    size = chunk_size or DEFAULT_CHUNK_SIZE
+    with _render_pool(processes) as executor:
+        # Enough entries to keep every worker busy with one chunk.
+        for window in _chunks(wavetool_castlist, size * max(processes, 1)):
+            pages = [None] * len(window)
+            keys = [None] * len(window)
+            if incremental is not None:
+                for index, character in enumerate(window):
+                    keys[index] = card_key(
+                        character, image_bytes(character["Image"]), style
+                    )
+                    pages[index] = incremental.get_page(keys[index])
+            missing = [i for i, page in enumerate(pages) if page is None]
+            chunks = list(_chunks(missing, size))
+            rendered = _map_chunks(
+                (
+                    ([window[i] for i in chunk], raster_background, True)
+                    for chunk in chunks
+                ),
+                executor,
+                processes,
+            )
+            for chunk, chunk_pages in zip(chunks, rendered):
+                for index, page in zip(chunk, chunk_pages):
+                    pages[index] = page
+                    if incremental is not None:
+                        incremental.put_page(keys[index], page)
+            yield from zip(window, pages)
+
+
+@span("pdf_write")
+def create_mic_cards(
+    wavetool_castlist,
+    output_file,
+    castlist_path,
+    incremental=None,
+    raster_background=None,
+    chunk_size=None,
+    processes=None,
+):
+    """
+    Write a mic card page for each entry to output_file. If an open
+    incremental.IncrementalBuild that reuses pages is given, pages are
+    rendered one at a time, reusing the page from the previous build when
+    nothing on the card has changed, and merged into the output.
+    The background is drawn from pdfbg.svg as vectors, or as an image when
+    raster_background is set (default: WAVETOOL_PDF_BACKGROUND=raster),
+    which makes smaller files but needs libvips.
+    With chunk_size (default: WAVETOOL_PDF_CHUNK_SIZE, 0 = off), the deck is
+    rendered chunk_size cards at a time across processes worker processes
+    (default: one per CPU) and the chunks are merged into the output, so
+    large decks use every core and each worker only holds one chunk.
+    Memory still grows with the deck: fpdf keeps every embedded image until
+    the document is written, and pypdf keeps every merged page (with its
+    compressed images) until write. Only the input entries can be spooled.
+    """
+    if raster_background is None:
+        raster_background = _raster_background_default()
+    if chunk_size is None:
+        chunk_size = _chunk_size_default()
+    if incremental is not None and not incremental.reuse_pages:
+        incremental = None
+    if incremental is None and not chunk_size:
+        pdf = _new_pdf()
+        for character in wavetool_castlist:
+            _add_card(pdf, character, raster_background)
+        pdf.output(output_file)
+        return
+
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    if incremental is not None:
+        for _, page in iter_card_pdfs(
+            wavetool_castlist,
+            incremental,
+            raster_background,
+            chunk_size,
+            processes,
+        ):
+            writer.append(PdfReader(BytesIO(page)))
+    else:
+        if processes is None:
+            processes = default_workers()
+        with _render_pool(processes) as executor:
+            for chunk_pdf in _map_chunks(
+                (
+                    (chunk, raster_background, False)
+                    for chunk in _chunks(wavetool_castlist, chunk_size)
+                ),
+                executor,
+                processes,
+            ):
+                writer.append(PdfReader(BytesIO(chunk_pdf)))
+    # Each page or chunk embeds its own copy of shared images and fonts.
+    writer.compress_identical_objects()
+    writer.write(output_file)
+
+
+def card_filename(index, character):
+    role = re.sub(r"[^\w-]+", "_", character["RoleName"]).strip("_")
+    return f"{index:03d}_{role or 'card'}.pdf"
+
+
+@span("pdf_write")
+def create_mic_card_zip(
+    wavetool_castlist,
+    output_file,
+    castlist_path,
+    incremental=None,
+    raster_background=None,
+    chunk_size=None,
+    processes=None,
+):
+    """
+    Write a zip of one PDF per mic card (named by position and role) to
+    output_file, for printing cards individually. Arguments are those of
+    create_mic_cards. Cards are written as they are rendered, so only one
+    window of pages is in memory at once.
+    """
+    with zipfile.ZipFile(output_file, "w", zipfile.ZIP_STORED) as archive:
+        for index, (character, page) in enumerate(
+            iter_card_pdfs(
+                wavetool_castlist,
+                incremental,
+                raster_background,
+                chunk_size,
+                processes,
+            ),
+            start=1,
+        ):
+            archive.writestr(card_filename(index, character), page)
+
+
+@span("pdf_write")
+def create_mic_cards_and_zip(
+    wavetool_castlist,
+    pdf_file,
+    zip_file,
+    castlist_path,
+    incremental=None,
+    raster_background=None,
+    chunk_size=None,
+    processes=None,
+):
+    """
+    Write both the mic cards PDF (as create_mic_cards) and the zip of one
+    PDF per card (as create_mic_card_zip), rendering each card only once:
+    the PDF is merged from the same pages that go into the zip. The zip is
+    streamed card by card, but the merged PDF is held until it is written.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_STORED) as archive:
+        for index, (character, page) in enumerate(
+            iter_card_pdfs(
+                wavetool_castlist,
+                incremental,
+                raster_background,
+                chunk_size,
+                processes,
+            ),
+            start=1,
+        ):
+            archive.writestr(card_filename(index, character), page)
+            writer.append(PdfReader(BytesIO(page)))
+    writer.compress_identical_objects()
+    writer.write(pdf_file)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python mic_cards.py <castlist.csv> <output.pdf>")
-        sys.exit(1)
-    castlist_file = sys.argv[1]
-    output_file = sys.argv[2]
-    castlist = import_castlist(castlist_file)
-    castlist_path = pathlib.Path(castlist_file).parent.resolve()
-    # Build the processed cast list array once.
-    wavetool_castlist = build_castlist(castlist, castlist_path)
-    if os.path.isfile(output_file):
-        overwrite = input("Output file already exists. Overwrite? (y/n): ")
-        if overwrite.lower() != "y":
-            sys.exit(0)
-    try:
-        with open(output_file, "wb") as out_fp:
-            create_mic_cards(wavetool_castlist, out_fp, castlist_path)
-    except IOError:
-        print("Could not open file: " + output_file)
-        traceback.print_exc()
-        sys.exit(1)
+    from wavetool import main
+
+    main(
+        output_format="pdf",
+        usage="python mic_cards.py [options] <castlist.csv> <output.pdf>",
+    )
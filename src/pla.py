@@ -0,0 +1,250 @@
+import re
+import sys
+import base64
+import plistlib
+from io import BytesIO
+from util import ImagePipeline, draft_box, image_bytes
+
+"""
+Reading, writing and checking WaveTool 3 player (.pla) files.
+
+A .pla file is a property list holding an array with one dictionary per
+player. WaveTool reads both the XML and the binary property list formats;
+binary files store each image as raw bytes instead of base64 text, so they
+are about a quarter smaller and quicker to write and to import.
+
+XML files are written by a streaming writer that emits the array one entry
+at a time and base64-encodes each image in chunks straight to the output,
+so memory does not grow with the cast size. Its output is byte-identical to
+plistlib.dump's.
+
+    python pla.py players.pla   # check a file and summarise its players
+"""
+
+PLA_FORMATS = {"xml": plistlib.FMT_XML, "binary": plistlib.FMT_BINARY}
+
+# Keys of a player entry and the types WaveTool expects for them.
+ENTRY_TYPES = {
+    "Channel": str,
+    "Comments": str,
+    "Compressed": bool,
+    "Image": bytes,
+    "Name": str,
+    "RoleName": str,
+    "Scaled": bool,
+    "Version": int,
+}
+
+
+# Characters plistlib refuses in strings.
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# plistlib wraps base64 to 76 columns less the indentation (tabs count as 8),
+# and an entry's <data> lines are indented by two tabs.
+_DATA_INDENT = b"\t\t"
+_DATA_LINE = (76 - 16) // 4 * 4
+# Image bytes encoded at a time; a whole number of lines' worth.
+_DATA_CHUNK = _DATA_LINE // 4 * 3 * 1024
+
+
+def _escape(text):
+    if _CONTROL_CHARS.search(text):
+        raise ValueError(
+            "strings can't contain control characters; use bytes instead"
+        )
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("&", "&amp;").replace("<", "&lt;")
+    return text.replace(">", "&gt;")
+
+
+def _image_chunks(image):
+    if isinstance(image, (bytes, bytearray)):
+        view = memoryview(image)
+        for start in range(0, len(view), _DATA_CHUNK):
+            yield view[start : start + _DATA_CHUNK]
+    else:
+        yield from image.iter_chunks(_DATA_CHUNK)
+
+
+def _write_xml_entry(entry, output_file):
+    write = output_file.write
+    if not entry:
+        write(b"\t<dict/>\n")
+        return
+    write(b"\t<dict>\n")
+    for key, value in sorted(entry.items()):
+        write(b"\t\t<key>%s</key>\n" % _escape(key).encode())
+        if key == "Image" or isinstance(value, (bytes, bytearray)):
+            write(b"\t\t<data>\n")
+            for chunk in _image_chunks(value):
+                encoded = base64.b64encode(chunk)
+                write(
+                    b"".join(
+                        _DATA_INDENT + encoded[i : i + _DATA_LINE] + b"\n"
+                        for i in range(0, len(encoded), _DATA_LINE)
+                    )
+                )
+            write(b"\t\t</data>\n")
+        elif value is True:
+            write(b"\t\t<true/>\n")
+        elif value is False:
+            write(b"\t\t<false/>\n")
+        elif isinstance(value, int):
+            write(b"\t\t<integer>%d</integer>\n" % value)
+        elif isinstance(value, str):
+            write(b"\t\t<string>%s</string>\n" % _escape(value).encode())
+        else:
+            raise TypeError(f"unsupported type: {type(value)}")
+    write(b"\t</dict>\n")
+
+
+def stream_pla_xml(entries, output_file):
+    """
+    Write entries (any iterable; images as bytes or spooled references) to
+    output_file as an XML .pla, one entry at a time. The output is the same,
+    byte for byte, as plistlib.dump's.
+    """
+    output_file.write(plistlib.PLISTHEADER)
+    output_file.write(b'<plist version="1.0">\n')
+    empty = True
+    for entry in entries:
+        if empty:
+            output_file.write(b"<array>\n")
+            empty = False
+        _write_xml_entry(entry, output_file)
+    output_file.write(b"<array/>\n" if empty else b"</array>\n")
+    output_file.write(b"</plist>\n")
+
+
+def compress_image(img_data, pipeline=None):
+    """
+    Return img_data as a JPEG no larger than the pipeline's size (512x512 by
+    default), the form described by an entry's "Compressed" and "Scaled"
+    flags. Images that are already in that form are returned unchanged
+    rather than encoded again.
+    """
+    from PIL import Image as PILImage
+
+    pipeline = pipeline or ImagePipeline()
+    image = PILImage.open(BytesIO(img_data))
+    if (
+        image.format == "JPEG"
+        and image.width <= pipeline.size[0]
+        and image.height <= pipeline.size[1]
+    ):
+        return img_data
+    image.draft("RGB", draft_box(image.size, pipeline.size))
+    image = image.convert("RGB")
+    image.thumbnail(pipeline.size)
+    out = BytesIO()
+    image.save(out, "JPEG", quality=pipeline.quality)
+    return out.getvalue()
+
+
+def pla_entry(entry, compress_images=False, pipeline=None):
+    """
+    Return a player entry ready for plistlib: its image as bytes and, with
+    compress_images, stored compressed and scaled (see compress_image) with
+    the flags set to match.
+    """
+    img_data = image_bytes(entry["Image"])
+    if not compress_images:
+        return dict(entry, Image=img_data)
+    return dict(
+        entry,
+        Image=compress_image(img_data, pipeline),
+        Compressed=True,
+        Scaled=True,
+    )
+
+
+def write_pla(
+    wavetool_castlist, output_file, fmt="xml", compress_images=False
+):
+    """
+    Write the entries to output_file as a .pla property list in fmt ("xml"
+    or "binary"). XML is streamed entry by entry (see stream_pla_xml); for
+    binary files plistlib needs every image in memory while it writes.
+    """
+    if fmt == "xml":
+        if compress_images:
+            wavetool_castlist = (
+                pla_entry(entry, compress_images)
+                for entry in wavetool_castlist
+            )
+        stream_pla_xml(wavetool_castlist, output_file)
+        return
+    plistlib.dump(
+        [pla_entry(entry, compress_images) for entry in wavetool_castlist],
+        output_file,
+        fmt=PLA_FORMATS[fmt],
+    )
+
+
+def validate_pla(pla_file, expected=None):
+    """
+    Read a .pla file (a path or binary file object) in either format and
+    check that it is an array of player entries with the expected keys and
+    types and images that decode. If expected entries are given, check that
+    the file holds the same players in the same order, with identical
+    images unless an entry is marked Compressed. Returns the entries read;
+    raises ValueError describing the first problem found.
+    """
+    from PIL import Image as PILImage
+
+    if isinstance(pla_file, (str, bytes)) or hasattr(pla_file, "__fspath__"):
+        with open(pla_file, "rb") as pla_fp:
+            entries = plistlib.load(pla_fp)
+    else:
+        entries = plistlib.load(pla_file)
+    if not isinstance(entries, list):
+        raise ValueError("A .pla file must hold an array of players.")
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Player {index} is not a dictionary.")
+        for key, value_type in ENTRY_TYPES.items():
+            if not isinstance(entry.get(key), value_type):
+                raise ValueError(
+                    f"Player {index} has no {value_type.__name__} {key!r}."
+                )
+        try:
+            PILImage.open(BytesIO(entry["Image"])).verify()
+        except Exception as e:
+            raise ValueError(f"Player {index} has an unreadable image: {e}")
+    if expected is not None:
+        expected = list(expected)
+        if len(entries) != len(expected):
+            raise ValueError(
+                f"Expected {len(expected)} players, found {len(entries)}."
+            )
+        for index, (entry, wanted) in enumerate(zip(entries, expected)):
+            for key in ENTRY_TYPES:
+                if key in ("Image", "Compressed", "Scaled"):
+                    continue
+                if entry[key] != wanted[key]:
+                    raise ValueError(
+                        f"Player {index} {key!r} is {entry[key]!r}, "
+                        f"expected {wanted[key]!r}."
+                    )
+            if not entry["Compressed"] and entry["Image"] != image_bytes(
+                wanted["Image"]
+            ):
+                raise ValueError(f"Player {index} image differs.")
+    return entries
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python pla.py <players.pla>")
+        sys.exit(2)
+    try:
+        players = validate_pla(sys.argv[1])
+    except (ValueError, plistlib.InvalidFileException) as e:
+        print(f"Invalid player file: {e}")
+        sys.exit(1)
+    for player in players:
+        print(
+            f"{player['Channel']:>4}  {player['RoleName']} "
+            f"({player['Name']}), {len(player['Image'])} byte image"
+        )
+    print(f"{len(players)} players OK")
@@ -0,0 +1,249 @@
+import os
+import time
+import shutil
+import logging
+import pathlib
+import tempfile
+import threading
+from incremental import lock_if_idle
+
+"""
+Retention for the web app's generated files and job records.
+
+A Sweeper runs in the background and, on every pass:
+  - removes output files older than the TTL, then the least recently used
+    ones until the output folder fits its byte budget;
+  - evicts all but the most recently used finished jobs from the job store,
+    together with their output files;
+  - removes stale temporary files left behind by interrupted jobs (Google
+    Sheet CSVs and image spool directories);
+  - removes incremental build directories not used within the output TTL
+    (skipping any that a running build has open).
+What each pass reclaimed is kept in Sweeper.stats.
+"""
+
+logger = logging.getLogger("retention")
+
+# Prefixes of the temporary files created by sheets_parser.google_sheet_to_csv
+# and spool.ImageSpool.
+TEMP_PREFIXES = ("wavetool_sheet_", "wavetool_spool_")
+
+
+class RetentionPolicy:
+    def __init__(
+        self,
+        output_ttl=7 * 24 * 3600,
+        output_max_bytes=1024 * 1024 * 1024,
+        max_finished_jobs=500,
+        temp_ttl=24 * 3600,
+    ):
+        self.output_ttl = output_ttl
+        self.output_max_bytes = output_max_bytes
+        self.max_finished_jobs = max_finished_jobs
+        self.temp_ttl = temp_ttl
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a policy from WAVETOOL_OUTPUT_TTL, WAVETOOL_OUTPUT_MAX_BYTES,
+        WAVETOOL_MAX_FINISHED_JOBS and WAVETOOL_TEMP_TTL, falling back to
+        the defaults for any that are unset.
+        """
+        defaults = cls()
+        env = os.environ.get
+        return cls(
+            output_ttl=float(env("WAVETOOL_OUTPUT_TTL", defaults.output_ttl)),
+            output_max_bytes=int(
+                env("WAVETOOL_OUTPUT_MAX_BYTES", defaults.output_max_bytes)
+            ),
+            max_finished_jobs=int(
+                env("WAVETOOL_MAX_FINISHED_JOBS", defaults.max_finished_jobs)
+            ),
+            temp_ttl=float(env("WAVETOOL_TEMP_TTL", defaults.temp_ttl)),
+        )
+
+
+def _remove(path):
+    """
+    Remove a file or directory tree and return the bytes it occupied.
+    """
+    try:
+        if path.is_dir():
+            size = sum(
+                f.stat().st_size for f in path.rglob("*") if f.is_file()
+            )
+            shutil.rmtree(path)
+        else:
+            size = path.stat().st_size
+            path.unlink()
+    except FileNotFoundError:
+        return 0
+    return size
+
+
+class Sweeper:
+    def __init__(
+        self,
+        store,
+        output_dir,
+        policy=None,
+        interval=600,
+        temp_dir=None,
+        build_dir=None,
+    ):
+        self.store = store
+        self.output_dir = pathlib.Path(output_dir)
+        self.policy = policy or RetentionPolicy()
+        self.interval = interval
+        self.temp_dir = pathlib.Path(temp_dir or tempfile.gettempdir())
+        self.build_dir = pathlib.Path(build_dir) if build_dir else None
+        self.stats = {
+            "sweeps": 0,
+            "last_sweep": None,
+            "files_removed": 0,
+            "bytes_reclaimed": 0,
+            "jobs_evicted": 0,
+            "temp_files_removed": 0,
+            "builds_removed": 0,
+            "output_bytes": 0,
+        }
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="retention-sweeper", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Retention sweep failed.")
+            self._stop.wait(self.interval)
+
+    def _sweep_outputs(self, now):
+        files_removed = 0
+        reclaimed = 0
+        entries = []
+        for path in self.output_dir.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.policy.output_ttl:
+                reclaimed += _remove(path)
+                files_removed += 1
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        # Downloads touch their file, so mtime order is least recently used.
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.policy.output_max_bytes:
+                break
+            reclaimed += _remove(path)
+            files_removed += 1
+            total -= size
+        return files_removed, reclaimed, total
+
+    def _evict_jobs(self):
+        files_removed = 0
+        reclaimed = 0
+        evicted = self.store.evict_finished(self.policy.max_finished_jobs)
+        for job in evicted:
+            for name in (job["pla"], job["pdf"]):
+                if name:
+                    size = _remove(self.output_dir / name)
+                    if size:
+                        files_removed += 1
+                        reclaimed += size
+        return len(evicted), files_removed, reclaimed
+
+    def _sweep_temp(self, now):
+        removed = 0
+        reclaimed = 0
+        for prefix in TEMP_PREFIXES:
+            for path in self.temp_dir.glob(f"{prefix}*"):
+                try:
+                    mtime = path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if now - mtime > self.policy.temp_ttl:
+                    reclaimed += _remove(path)
+                    removed += 1
+        return removed, reclaimed
+
+    def _sweep_builds(self, now):
+        removed = 0
+        reclaimed = 0
+        if self.build_dir is None or not self.build_dir.is_dir():
+            return removed, reclaimed
+        for path in self.build_dir.iterdir():
+            if not self._build_is_stale(path, now):
+                continue
+            if not path.is_dir():
+                reclaimed += _remove(path)
+                removed += 1
+                continue
+            # A running build holds the directory's lock, so leave it alone.
+            # A build that opens the directory while it is being removed
+            # starts again in a new one.
+            lock_fp = lock_if_idle(path)
+            if lock_fp is None:
+                continue
+            with lock_fp:
+                # It may have been used between the check and the lock.
+                if self._build_is_stale(path, now):
+                    reclaimed += _remove(path)
+                    removed += 1
+        return removed, reclaimed
+
+    def _build_is_stale(self, path, now):
+        # Every build touches its manifest when it opens the directory and
+        # rewrites it when it finishes, so its mtime is when the build
+        # directory was last used.
+        manifest = path / "manifest.json"
+        if not manifest.exists():
+            manifest = path
+        try:
+            mtime = manifest.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return now - mtime > self.policy.output_ttl
+
+    def sweep(self):
+        """
+        Run one retention pass and return what it reclaimed.
+        """
+        now = time.time()
+        jobs_evicted, job_files, job_bytes = self._evict_jobs()
+        output_files, output_bytes, remaining = self._sweep_outputs(now)
+        temp_files, temp_bytes = self._sweep_temp(now)
+        builds, build_bytes = self._sweep_builds(now)
+        result = {
+            "files_removed": job_files + output_files,
+            "bytes_reclaimed": job_bytes
+            + output_bytes
+            + temp_bytes
+            + build_bytes,
+            "jobs_evicted": jobs_evicted,
+            "temp_files_removed": temp_files,
+            "builds_removed": builds,
+        }
+        with self._lock:
+            self.stats["sweeps"] += 1
+            self.stats["last_sweep"] = now
+            for name, value in result.items():
+                self.stats[name] += value
+            self.stats["output_bytes"] = remaining
+        if any(result.values()):
+            logger.info(f"Retention sweep reclaimed: {result}")
+        return result
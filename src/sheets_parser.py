@@ -1,3 +1,4 @@
+import os
 import re
 import csv
 import tempfile
@@ -5,6 +6,18 @@ from googleapiclient.discovery import build
 import logging
 import json
 
+logger = logging.getLogger("util.sheets")
+
+TEMP_CSV_PREFIX = "wavetool_sheet_"
+
+# The only cell properties google_sheet_rows reads. Asking for just these
+# leaves formatting and other metadata for every cell out of the response.
+GRID_FIELDS = "sheets(data(rowData(values(formattedValue,hyperlink))))"
+
+DEFAULT_SHEETS_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "wavetool_utilities", "sheets"
+)
+
 
 def get_direct_drive_link(url: str) -> str:
     """
@@ -75,40 +88,79 @@ def debug_dump_sheet(sheet_url: str, api_key: str):
             print()  # blank line for readability
 
 
-def google_sheet_to_csv(sheet_url: str, api_key: str) -> str:
+def sheet_revision(spreadsheet_id: str, api_key: str, drive_service=None):
     """
-    Uses the Google Sheets API with includeGridData to fetch the full cell data from a public sheet.
-    For the "Image" column, if a cell contains a hyperlink (the actual image URL), it is used;
-    otherwise, the formatted value is used. If the URL appears to be a Google Drive sharing URL,
-    it's converted to a direct link.
+    Return the spreadsheet's Drive file version, which increases on every
+    change, or None if it cannot be read (e.g. the Drive API is not enabled
+    for the key). This is a small metadata request.
+    """
+    try:
+        if drive_service is None:
+            drive_service = build("drive", "v3", developerKey=api_key)
+        metadata = (
+            drive_service.files()
+            .get(
+                fileId=spreadsheet_id, fields="version", supportsAllDrives=True
+            )
+            .execute()
+        )
+        return metadata.get("version")
+    except Exception as e:
+        logger.info(f"Could not read the revision of the sheet: {e}")
+        return None
+
 
-    Returns the path to a temporary CSV file with the sheet data.
+class SheetCache:
+    """
+    Parsed sheet rows on disk, keyed by spreadsheet ID and revision.
     """
-    # Extract the spreadsheet ID from the URL.
-    import re
 
-    match = re.search(r"/d/([^/]+)", sheet_url)
-    if not match:
-        raise ValueError("Invalid Google Sheets URL format.")
-    spreadsheet_id = match.group(1)
+    def __init__(self, directory=DEFAULT_SHEETS_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
 
-    # Assume the first sheet. You can adjust this if needed.
-    sheet_range = "Sheet1"
+    def _path(self, spreadsheet_id):
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", spreadsheet_id)
+        return os.path.join(self.directory, f"{safe_id}.json")
 
-    # Build the Sheets API service.
-    service = build("sheets", "v4", developerKey=api_key)
+    def get(self, spreadsheet_id, revision):
+        try:
+            with open(self._path(spreadsheet_id), encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("revision") != revision:
+            return None
+        return cached["rows"]
 
-    # Get the full sheet with grid data.
-    result = (
-        service.spreadsheets()
-        .get(
-            spreadsheetId=spreadsheet_id,
-            ranges=sheet_range,
-            includeGridData=True,
-        )
-        .execute()
+    def put(self, spreadsheet_id, revision, rows):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"revision": revision, "rows": rows}, f)
+        os.replace(tmp_path, self._path(spreadsheet_id))
+
+
+def default_sheet_cache():
+    """
+    Return the SheetCache shared by the scripts and the web app, or None if
+    WAVETOOL_SHEETS_CACHE_DIR is set to an empty value.
+    """
+    directory = os.environ.get(
+        "WAVETOOL_SHEETS_CACHE_DIR", DEFAULT_SHEETS_CACHE_DIR
     )
+    if not directory:
+        return None
+    return SheetCache(os.path.expanduser(directory))
+
 
+def parse_grid(result) -> list:
+    """
+    Convert a spreadsheets().get response into a list of rows, the first
+    being the header.
+    For the "Image" column, if a cell contains a hyperlink (the actual image URL), it is used;
+    otherwise, the formatted value is used. If the URL appears to be a Google Drive sharing URL,
+    it's converted to a direct link.
+    """
     sheets = result.get("sheets", [])
     if not sheets:
         raise ValueError("No sheets found in the spreadsheet.")
@@ -159,10 +211,76 @@ def google_sheet_to_csv(sheet_url: str, api_key: str) -> str:
                     cell_value = get_direct_drive_link(cell_value)
             row_values.append(cell_value)
         processed_rows.append(row_values)
+    return processed_rows
+
+
+def google_sheet_rows(
+    sheet_url: str,
+    api_key: str,
+    service=None,
+    drive_service=None,
+    cache=None,
+) -> list:
+    """
+    Fetch a public sheet with the Google Sheets API and return its rows (see
+    parse_grid). Only the cell values and hyperlinks are requested.
+
+    Parsed rows are cached by spreadsheet ID and Drive revision (in cache,
+    or the default SheetCache), so fetching an unchanged sheet only costs a
+    metadata request. service and drive_service may be given to use
+    pre-built (or stub) API clients.
+    """
+    # Extract the spreadsheet ID from the URL.
+    match = re.search(r"/d/([^/]+)", sheet_url)
+    if not match:
+        raise ValueError("Invalid Google Sheets URL format.")
+    spreadsheet_id = match.group(1)
+
+    # Assume the first sheet. You can adjust this if needed.
+    sheet_range = "Sheet1"
+
+    if cache is None:
+        cache = default_sheet_cache()
+    revision = None
+    if cache is not None:
+        revision = sheet_revision(spreadsheet_id, api_key, drive_service)
+        if revision is not None:
+            rows = cache.get(spreadsheet_id, revision)
+            if rows is not None:
+                logger.info(f"Sheet unchanged (revision {revision}), cached.")
+                return rows
+
+    # Build the Sheets API service.
+    if service is None:
+        service = build("sheets", "v4", developerKey=api_key)
+
+    # Get the cell values and hyperlinks of the sheet.
+    result = (
+        service.spreadsheets()
+        .get(
+            spreadsheetId=spreadsheet_id,
+            ranges=sheet_range,
+            fields=GRID_FIELDS,
+        )
+        .execute()
+    )
+    rows = parse_grid(result)
+    if revision is not None:
+        cache.put(spreadsheet_id, revision, rows)
+    return rows
+
+
+def google_sheet_to_csv(sheet_url: str, api_key: str, **kwargs) -> str:
+    """
+    Fetch a sheet with google_sheet_rows (keyword arguments are passed on)
+    and return the path to a temporary CSV file with the sheet data.
+    """
+    processed_rows = google_sheet_rows(sheet_url, api_key, **kwargs)
 
-    # Write the processed data to a temporary CSV file.
-    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-    with open(tmp_file.name, "w", newline="", encoding="utf-8") as f:
+    # Write the processed data to a temporary CSV file. The caller removes
+    # it; the prefix lets retention.py sweep up any that are left behind.
+    fd, tmp_path = tempfile.mkstemp(prefix=TEMP_CSV_PREFIX, suffix=".csv")
+    with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerows(processed_rows)
-    return tmp_file.name
+    return tmp_path
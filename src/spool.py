@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import threading
+
+"""
+Spill processed images to disk so a cast list can be built without holding
+every image in memory. Writers read the images back one at a time, but some
+keep what they read until their output is complete: the mic cards PDF and
+binary player files still grow with the cast size (see mic_cards.py and
+pla.write_pla); XML player files and mic card zips do not.
+"""
+
+
+class SpooledImage:
+    """
+    A reference to an image held in an ImageSpool. Writers that accept a
+    file path can use path directly; read() returns the bytes.
+    """
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"SpooledImage({self.path!r}, size={self.size})"
+
+    def read(self):
+        with open(self.path, "rb") as fp:
+            return fp.read()
+
+    def iter_chunks(self, chunk_size):
+        """
+        Yield the image's bytes chunk_size bytes at a time.
+        """
+        with open(self.path, "rb") as fp:
+            while True:
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class ImageSpool:
+    """
+    A temporary directory of images, removed when the spool is closed.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(
+            prefix="wavetool_spool_", dir=directory
+        )
+        self._count = 0
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, img_data, shared=False):
+        """
+        Write img_data to the spool and return a SpooledImage for it. A
+        shared buffer (one handed to many rows, such as the default image)
+        is written once and every row gets the same SpooledImage.
+        """
+        if shared:
+            with self._lock:
+                if id(img_data) in self._shared:
+                    return self._shared[id(img_data)][1]
+            image = self.add(img_data)
+            with self._lock:
+                # Keep the buffer so its id is not reused.
+                return self._shared.setdefault(
+                    id(img_data), (img_data, image)
+                )[1]
+        with self._lock:
+            self._count += 1
+            index = self._count
+        path = os.path.join(self.directory, f"{index:06d}.img")
+        with open(path, "wb") as fp:
+            fp.write(img_data)
+        return SpooledImage(path, len(img_data))
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,63 @@
+import logging
+import contextvars
+from contextlib import contextmanager
+
+"""
+Route log records to the job that produced them.
+
+A single TaskLogHandler is installed once per process. Each job runs inside
+task_context(task_id), and the handler sends every record to the sink of the
+task that is current in the logging thread's context. The cost of a log line
+is constant however many jobs the process has run, and concurrent jobs never
+see each other's lines. Worker threads started for a job must run in a copy
+of its context (see fetch.ImageFetcher) for their records to be routed.
+"""
+
+current_task = contextvars.ContextVar("current_task", default=None)
+
+
+class TaskLogHandler(logging.Handler):
+    """
+    Formats each record once and passes it to sink(task_id, message).
+    Records logged outside any task are ignored.
+    """
+
+    def __init__(self, sink):
+        super().__init__()
+        self.sink = sink
+
+    def emit(self, record):
+        task_id = current_task.get()
+        if task_id is None:
+            return
+        try:
+            self.sink(task_id, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+@contextmanager
+def task_context(task_id):
+    """
+    Attribute log records from this context (thread) to task_id.
+    """
+    token = current_task.set(task_id)
+    try:
+        yield
+    finally:
+        current_task.reset(token)
+
+
+def install(sink, logger_names, level=logging.INFO, fmt=None):
+    """
+    Attach one TaskLogHandler for sink to each named logger and return it.
+    """
+    handler = TaskLogHandler(sink)
+    handler.setFormatter(
+        logging.Formatter(fmt or "%(asctime)s - %(levelname)s - %(message)s")
+    )
+    for name in logger_names:
+        task_logger = logging.getLogger(name)
+        task_logger.setLevel(level)
+        task_logger.addHandler(handler)
+    return handler
@@ -1,21 +1,32 @@
 import csv
+import math
+from collections import namedtuple
+from itertools import islice
 from io import BytesIO
-from PIL import Image as PILImage
-import face_recognition
-import os
-import pathlib
-import re
-import requests
-import traceback
-import sys
 import logging
+from fetch import ImageFetcher, DEFAULT_WORKERS
+from image_cache import cache_key
+from crop_engine import shared_engine
+from incremental import row_fingerprint
+from assets import processed_default_image, is_asset
+from metrics import span
 
 logger = logging.getLogger("util")
 
+# Pillow, numpy and face_recognition (which loads dlib and its models) are
+# imported by the functions that use them, so importing this module, or
+# building a cast list whose rows are neither cropped nor resized, stays
+# cheap.
 
-def import_castlist(castlist_file, default_resize=True):
+# Rows fetched and processed together by iter_castlist.
+DEFAULT_CHUNK_SIZE = 32
+
+
+def castlist_from_rows(rows, default_resize=True):
     """
-    Import a cast list from a CSV file.
+    Import a cast list from any iterable of rows given as dictionaries keyed
+    by column heading (a csv.DictReader, a Sheets response via
+    castlist_from_table, ...).
     For each row, it extracts:
       - "Real Name"
       - "Character"
@@ -27,93 +38,246 @@ def import_castlist(castlist_file, default_resize=True):
     Returns a list of dictionaries.
     """
     castlist = []
-    with open(castlist_file, newline="") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            real_name = row.get("Real Name", "").strip()
-            character = row.get("Character", "").strip()
-            comments = row.get("Comments", "").strip()
-            image = row.get("Image", "").strip() or None
-            crop = row.get("Crop", "1") == "1"  # default True
-            resize = row.get("Resize", "1" if default_resize else "0") == "1"
-            channel = row.get("Channel", "").strip()
-            if real_name == "" and character == "":
-                continue
-            castlist.append(
-                {
-                    "character": character,
-                    "real_name": real_name,
-                    "comments": comments,
-                    "image": image,
-                    "crop": crop,
-                    "resize": resize,
-                    "channel": channel,
-                }
-            )
+    for row in rows:
+        # Short rows leave missing columns as None.
+        row = {key: value or "" for key, value in row.items()}
+        real_name = row.get("Real Name", "").strip()
+        character = row.get("Character", "").strip()
+        comments = row.get("Comments", "").strip()
+        image = row.get("Image", "").strip() or None
+        crop = row.get("Crop", "1") == "1"  # default True
+        resize = row.get("Resize", "1" if default_resize else "0") == "1"
+        channel = row.get("Channel", "").strip()
+        if real_name == "" and character == "":
+            continue
+        castlist.append(
+            {
+                "character": character,
+                "real_name": real_name,
+                "comments": comments,
+                "image": image,
+                "crop": crop,
+                "resize": resize,
+                "channel": channel,
+            }
+        )
     return castlist
 
 
-def crop_image(image_buffer):
-    from io import BytesIO
-    from PIL import Image as PILImage
+def castlist_from_table(table, default_resize=True):
+    """
+    Import a cast list from an in-memory table: a list of rows (lists of
+    cell values) whose first row holds the column headings, such as the
+    rows returned by sheets_parser.google_sheet_rows.
+    """
+    if not table:
+        return []
+    header = table[0]
+    return castlist_from_rows(
+        (dict(zip(header, row)) for row in table[1:]), default_resize
+    )
+
+
+def import_castlist(castlist_file, default_resize=True):
+    """
+    Import a cast list from a CSV file (see castlist_from_rows).
+    Returns a list of dictionaries.
+    """
+    with open(castlist_file, newline="") as csvfile:
+        return castlist_from_rows(csv.DictReader(csvfile), default_resize)
+
+
+class DetectionStrategy(
+    namedtuple("DetectionStrategy", ["model", "proxy_size", "upsample"])
+):
+    """
+    How faces are located before cropping.
+      - model: "cnn" (dlib's CNN detector, accurate but slow) or "hog"
+      - proxy_size: longest edge of the downscaled copy that detection runs
+        on; 0 or None detects on the full-resolution image
+      - upsample: number_of_times_to_upsample passed to face_recognition
+    """
+
+    __slots__ = ()
+
+
+DETECTION_MODELS = ("cnn", "hog")
+DEFAULT_DETECTION = DetectionStrategy(model="cnn", proxy_size=1024, upsample=0)
+# Images per face detection batch; 1 detects each image on its own.
+DEFAULT_DETECT_BATCH = 1
+
+
+def needs_detection_proxy(image_size, detection):
+    """
+    Return True if an image of image_size (width, height) is larger than
+    detection.proxy_size, so detection should run on a downscaled copy.
+    """
+    proxy_size = detection.proxy_size
+    return bool(proxy_size) and max(image_size) > proxy_size
+
+
+def scale_face_location(face_location, proxy_size, image_size):
+    """
+    Map a (top, right, bottom, left) face location found on a proxy of
+    proxy_size (width, height) back to an image of image_size.
+    """
+    scale_x = image_size[0] / proxy_size[0]
+    scale_y = image_size[1] / proxy_size[1]
+    top, right, bottom, left = face_location
+    return (
+        round(top * scale_y),
+        round(right * scale_x),
+        round(bottom * scale_y),
+        round(left * scale_x),
+    )
+
+
+def _detection_proxy(rgb_image, detection):
+    if needs_detection_proxy(rgb_image.size, detection):
+        proxy = rgb_image.copy()
+        proxy.thumbnail((detection.proxy_size, detection.proxy_size))
+        return proxy
+    return rgb_image
+
+
+def detect_face(rgb_image, detection=DEFAULT_DETECTION):
+    """
+    Locate the first face in a decoded RGB PIL image.
+    Detection runs on a proxy no larger than detection.proxy_size and the box
+    is mapped back to full-resolution coordinates.
+    Returns (top, right, bottom, left), or None if no face was found.
+    """
+    import numpy
+    import face_recognition
+
+    proxy = _detection_proxy(rgb_image, detection)
+    with span("detect"):
+        face_locations = face_recognition.face_locations(
+            numpy.asarray(proxy),
+            number_of_times_to_upsample=detection.upsample,
+            model=detection.model,
+        )
+    logger.info(f"Debug: Detected face locations: {face_locations}")
+    if not face_locations:
+        return None
+    return scale_face_location(face_locations[0], proxy.size, rgb_image.size)
+
+
+def detect_faces(
+    rgb_images, detection=DEFAULT_DETECTION, batch_size=DEFAULT_DETECT_BATCH
+):
+    """
+    Locate the first face in each of several decoded RGB PIL images, as
+    detect_face does for one. With the CNN model, the proxies are padded at
+    the bottom and right to a common size and passed to dlib batch_size at a
+    time, which it processes much more efficiently than single images; the
+    padding is black, so boxes only need scaling back to each image. The HOG
+    model has no batch interface and detects one image at a time.
+    Returns a list of (top, right, bottom, left) or None, one per image.
+    """
+    if detection.model != "cnn" or batch_size < 2 or len(rgb_images) < 2:
+        return [detect_face(image, detection) for image in rgb_images]
+
+    import numpy
     import face_recognition
 
+    results = []
+    for start in range(0, len(rgb_images), batch_size):
+        images = rgb_images[start : start + batch_size]
+        proxies = [_detection_proxy(image, detection) for image in images]
+        width = max(proxy.width for proxy in proxies)
+        height = max(proxy.height for proxy in proxies)
+        arrays = []
+        for proxy in proxies:
+            canvas = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+            canvas[: proxy.height, : proxy.width] = numpy.asarray(proxy)
+            arrays.append(canvas)
+        with span("detect"):
+            batch_locations = face_recognition.batch_face_locations(
+                arrays,
+                number_of_times_to_upsample=detection.upsample,
+                batch_size=len(arrays),
+            )
+        for image, proxy, face_locations in zip(
+            images, proxies, batch_locations
+        ):
+            # Trim boxes to the proxy, as face_locations trims to the image.
+            face_locations = [
+                (
+                    max(top, 0),
+                    min(right, proxy.width),
+                    min(bottom, proxy.height),
+                    max(left, 0),
+                )
+                for top, right, bottom, left in face_locations
+            ]
+            logger.info(f"Debug: Detected face locations: {face_locations}")
+            results.append(
+                scale_face_location(face_locations[0], proxy.size, image.size)
+                if face_locations
+                else None
+            )
+    return results
+
+
+def face_crop_box(face_location, image_size):
+    """
+    Expand a (top, right, bottom, left) face location by half the face size
+    on every side, clamped to the image, and return it as a PIL crop box.
+    """
+    top, right, bottom, left = face_location
+    width, height = image_size
+    face_width = right - left
+    face_height = bottom - top
+    left = max(0, left - (face_width / 2))
+    right = min(width, right + (face_width / 2))
+    top = max(0, top - (face_height / 2))
+    bottom = min(height, bottom + (face_height / 2))
+    logger.info(
+        f"Debug: Cropping image with box coordinates: left={left}, top={top}, right={right}, bottom={bottom}"
+    )
+    return (left, top, right, bottom)
+
+
+def crop_image(image_buffer, detection=DEFAULT_DETECTION):
     if not image_buffer:
         logger.info("Debug: Empty image buffer.")
         return image_buffer
 
+    from PIL import Image as PILImage
+
     try:
         pil_image = PILImage.open(BytesIO(image_buffer))
         logger.info(f"Debug: Successfully opened image. Size: {pil_image.size}")
+        # Decode once; the same RGB raster feeds detection and cropping.
+        rgb_image = pil_image.convert("RGB")
     except Exception as e:
         logger.info(f"Debug: Could not open image from buffer. Error: {e}")
         return image_buffer
 
     try:
-        image_array = face_recognition.load_image_file(BytesIO(image_buffer))
-    except Exception as e:
-        logger.info(
-            f"Debug: face_recognition.load_image_file failed. Error: {e}"
-        )
-        return image_buffer
-
-    try:
-        face_locations = face_recognition.face_locations(
-            image_array, number_of_times_to_upsample=0, model="cnn"
-        )
-        logger.info(f"Debug: Detected face locations: {face_locations}")
+        face_location = detect_face(rgb_image, detection)
     except RuntimeError as e:
         logger.info(
             f"Debug: RuntimeError in face_recognition.face_locations: {e}"
         )
         return image_buffer
 
-    if not face_locations:
+    if face_location is None:
         logger.info("Debug: No faces found in image. Skipping crop.")
         new_buffer = BytesIO()
-        pil_image.save(new_buffer, "JPEG")
+        rgb_image.save(new_buffer, "JPEG")
         return new_buffer.getvalue()
 
-    top, right, bottom, left = face_locations[0]
-    face_width = right - left
-    face_height = bottom - top
-    left = max(0, left - (face_width / 2))
-    right = min(pil_image.width, right + (face_width / 2))
-    top = max(0, top - (face_height / 2))
-    bottom = min(pil_image.height, bottom + (face_height / 2))
-    logger.info(
-        f"Debug: Cropping image with box coordinates: left={left}, top={top}, right={right}, bottom={bottom}"
-    )
-
-    cropped = pil_image.crop((left, top, right, bottom))
-    if cropped.mode == "RGBA":
-        cropped = cropped.convert("RGB")
+    cropped = rgb_image.crop(face_crop_box(face_location, rgb_image.size))
     new_buffer = BytesIO()
     cropped.save(new_buffer, "JPEG")
     return new_buffer.getvalue()
 
 
 def resize_image(image_buffer):
+    from PIL import Image as PILImage
+
     image = PILImage.open(BytesIO(image_buffer))
     image.thumbnail((512, 512))
     new_buffer = BytesIO()
@@ -121,67 +285,442 @@ def resize_image(image_buffer):
     return new_buffer.getvalue()
 
 
-def build_castlist(castlist, castlist_path):
+def draft_box(image_size, box):
     """
-    Given an imported cast list (list of dictionaries) and the directory (as a Path)
-    where the CSV file is located, process each row to download and process images.
-    Returns a new list (wavetool_castlist) that is used for output generation.
+    Return the size to pass to a JPEG image's draft() so that it decodes as
+    small as it can while still covering box once fitted inside it (as
+    thumbnail() does). draft() only reduces while both dimensions stay at
+    or above the size asked for, so asking for box itself leaves anything
+    but a square original at full size.
     """
-    default_image_path = os.path.join(
-        str(pathlib.Path(__file__).parent.resolve()), "../defaultimage.tiff"
-    )
-    with open(default_image_path, "rb") as image_fp:
-        default_image = image_fp.read()
+    width, height = image_size
+    scale = min(box[0] / width, box[1] / height)
+    return (math.ceil(width * scale), math.ceil(height * scale))
 
-    wavetool_castlist = []
-    for row in castlist:
+
+class ImagePipeline:
+    """
+    Crop and/or resize an image with a single decode and a single encode.
+
+    JPEG sources are decoded with the decoder's draft mode, which scales by
+    1/2, 1/4 or 1/8 during decoding, to just what the output needs: the
+    thumbnail size when only resizing, or a long edge of at least draft_size
+    when cropping first so the face region keeps enough resolution (the
+    same size the vips backend shrinks to). Detection, cropping and
+    thumbnailing all work on that one in-memory raster, which is then encoded
+    once in output_format. Rows with neither crop nor resize pass through.
+
+    With detect_batch_size above 1, the crop engine hands the pipeline that
+    many rows at a time (process_batch) and their faces are detected in one
+    batch. Batching does not change the output, so it is not a cache option.
+    """
+
+    backend = "pillow"
+
+    def __init__(
+        self,
+        detection=DEFAULT_DETECTION,
+        size=(512, 512),
+        output_format="JPEG",
+        quality=75,
+        draft_size=2048,
+        detect_batch_size=DEFAULT_DETECT_BATCH,
+    ):
+        self.detection = detection
+        self.size = tuple(size)
+        self.output_format = output_format
+        self.quality = quality
+        self.draft_size = draft_size
+        self.detect_batch_size = detect_batch_size
+
+    def cache_options(self, crop, resize):
+        """
+        The options that determine this pipeline's output for a row, for use
+        as part of its cache key.
+        """
+        return {
+            "backend": self.backend,
+            "crop": crop,
+            "resize": resize,
+            "detection": tuple(self.detection) if crop else None,
+            "size": self.size if resize else None,
+            "output_format": self.output_format,
+            "quality": self.quality,
+            "draft_size": self.draft_size if crop and resize else None,
+        }
+
+    def decode(self, image_buffer, crop, resize):
+        from PIL import Image as PILImage
+
+        with span("decode"):
+            image = PILImage.open(BytesIO(image_buffer))
+            logger.info(
+                f"Debug: Successfully opened image. Size: {image.size}"
+            )
+            if resize and crop:
+                box = (self.draft_size, self.draft_size)
+                image.draft("RGB", draft_box(image.size, box))
+            elif resize:
+                image.draft("RGB", draft_box(image.size, self.size))
+            if crop or image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            else:
+                image.load()
+        return image
+
+    def encode(self, image):
+        with span("encode"):
+            new_buffer = BytesIO()
+            image.save(new_buffer, self.output_format, quality=self.quality)
+            return new_buffer.getvalue()
+
+    def finish(self, image, crop, resize, face_location):
+        """
+        Crop a decoded image around face_location (when cropping), resize
+        it and encode it.
+        """
+        if crop:
+            if face_location is None:
+                logger.info("Debug: No faces found in image. Skipping crop.")
+            else:
+                with span("crop"):
+                    image = image.crop(
+                        face_crop_box(face_location, image.size)
+                    )
+        if resize:
+            with span("resize"):
+                image.thumbnail(self.size)
+        return self.encode(image)
+
+    def process(self, image_buffer, crop, resize):
+        if not image_buffer or not (crop or resize):
+            return image_buffer
+        image = self.decode(image_buffer, crop, resize)
+        face_location = detect_face(image, self.detection) if crop else None
+        return self.finish(image, crop, resize, face_location)
+
+    def process_batch(self, jobs):
+        """
+        Process several (image_buffer, crop, resize) jobs, detecting the
+        faces of the images being cropped together (see detect_faces). Every
+        image in the batch is decoded before any is encoded. Returns a list
+        of (image bytes, None) or (None, error message), one per job.
+        """
+        results = [None] * len(jobs)
+        decoded = {}
+        for index, (image_buffer, crop, resize) in enumerate(jobs):
+            if not image_buffer or not (crop or resize):
+                results[index] = (image_buffer, None)
+                continue
+            try:
+                decoded[index] = self.decode(image_buffer, crop, resize)
+            except Exception as e:
+                results[index] = (None, f"{type(e).__name__}: {e}")
+        to_detect = [index for index in decoded if jobs[index][1]]
+        face_locations = dict(
+            zip(
+                to_detect,
+                detect_faces(
+                    [decoded[index] for index in to_detect],
+                    self.detection,
+                    self.detect_batch_size,
+                ),
+            )
+        )
+        for index, image in decoded.items():
+            _, crop, resize = jobs[index]
+            try:
+                results[index] = (
+                    self.finish(
+                        image, crop, resize, face_locations.get(index)
+                    ),
+                    None,
+                )
+            except Exception as e:
+                results[index] = (None, f"{type(e).__name__}: {e}")
+        return results
+
+
+IMAGE_BACKENDS = ("pillow", "vips")
+
+
+def make_pipeline(backend="pillow", **kwargs):
+    """
+    Return an image pipeline for the named backend: "pillow" (ImagePipeline)
+    or "vips" (vips_backend.VipsImagePipeline, which needs libvips).
+    Keyword arguments are passed to the pipeline.
+    """
+    if backend == "vips":
+        from vips_backend import VipsImagePipeline
+
+        return VipsImagePipeline(**kwargs)
+    if backend == "pillow":
+        return ImagePipeline(**kwargs)
+    raise ValueError(f"Unknown image backend: {backend}")
+
+
+def image_bytes(image):
+    """
+    Return the bytes of an entry's "Image", which is either bytes or a
+    spooled reference to them (see spool.SpooledImage).
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return image
+    return image.read()
+
+
+def make_cast_dict(row, img_data):
+    """
+    Build a WaveTool player entry from an imported row and its final image.
+    """
+    return {
+        "Comments": row["comments"],
+        "Compressed": False,
+        "Image": img_data,
+        "Name": row["real_name"],
+        "RoleName": row["character"],
+        "Scaled": False,
+        "Channel": row["channel"],
+        "Version": 1,
+    }
+
+
+def _process_rows(rows, fetched_images, pipeline, cache, engine):
+    """
+    Turn the fetched source images for rows into final images, using the
+    cache where possible and the crop engine for everything else. Rows
+    without an image share the default image, processed once per process
+    (see assets.py).
+    Returns the images in the same order as rows.
+    """
+    images = []
+    keys = []
+    pending = []
+    for index, (row, fetched) in enumerate(zip(rows, fetched_images)):
         logger.info(
             f"Processing {row['character']} played by {row['real_name']}"
         )
-        img_data = default_image
-        if row["image"] is not None:
-            if re.match(r"^(http|https)://", row["image"]):
-                try:
-                    logger.info(f"  Downloading image from {row['image']}...")
-                    r = requests.get(row["image"])
-                    if r.ok:
-                        img_data = r.content
-                        logger.info("Success!")
-                    else:
-                        logger.info("Failed!")
-                except Exception as e:
-                    logger.info(f"Failed! {e}")
-            else:
-                try:
-                    image_path = row["image"]
-                    if not os.path.exists(image_path):
-                        image_path = os.path.join(castlist_path, row["image"])
-                    with open(image_path, "rb") as img_fp:
-                        img_data = img_fp.read()
-                except IOError:
-                    img_data = default_image
-        if row["crop"]:
-            logger.info(
-                f"Cropping image for {row['real_name']} to remove whitespace"
+        if fetched is None:
+            images.append(
+                processed_default_image(
+                    pipeline, row["crop"], row["resize"], engine
+                )
             )
-            try:
-                img_data = crop_image(img_data)
-            except Exception:
-                traceback.print_exc()
-                logger.info("Error cropping image")
-                sys.exit(1)
-        if row["resize"]:
-            logger.info(f"Resizing image for {row['real_name']} to 512x512")
-            img_data = resize_image(img_data)
-        cast_dict = {
-            "Comments": row["comments"],
-            "Compressed": False,
-            "Image": img_data,
-            "Name": row["real_name"],
-            "RoleName": row["character"],
-            "Scaled": False,
-            "Channel": row["channel"],
-            "Version": 1,
-        }
-        wavetool_castlist.append(cast_dict)
-    return wavetool_castlist
+            keys.append(None)
+            continue
+        img_data = fetched
+        needs_processing = row["crop"] or row["resize"]
+        key = None
+        if cache is not None:
+            key = cache_key(
+                img_data, **pipeline.cache_options(row["crop"], row["resize"])
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info(f"Using cached image for {row['real_name']}")
+                img_data = cached
+                needs_processing = False
+        if needs_processing:
+            pending.append(index)
+        images.append(img_data)
+        keys.append(key)
+
+    if pending:
+        engine = engine or shared_engine()
+        logger.info(
+            f"Cropping/resizing {len(pending)} images on "
+            f"{max(engine.processes, 1)} worker(s)..."
+        )
+        jobs = [
+            (images[i], rows[i]["crop"], rows[i]["resize"], pipeline)
+            for i in pending
+        ]
+        failed = []
+        for index, (img_data, error) in zip(pending, engine.map(jobs)):
+            row = rows[index]
+            if error is not None:
+                logger.info(
+                    f"Error processing image for {row['real_name']}: {error}"
+                )
+                failed.append(index)
+                continue
+            images[index] = img_data
+            if keys[index] is not None:
+                cache.put(keys[index], img_data)
+        # Only the failed rows fall back to the default image.
+        for index in failed:
+            images[index] = processed_default_image(
+                pipeline, rows[index]["crop"], rows[index]["resize"], engine
+            )
+    return images
+
+
+def _build_rows(rows, fetcher, pipeline, cache, engine):
+    logger.info(f"Fetching images for {len(rows)} entries...")
+    fetched_images = fetcher.fetch_all(row["image"] for row in rows)
+    return _process_rows(rows, fetched_images, pipeline, cache, engine)
+
+
+def _reuse_rows(rows, fetcher, pipeline, cache, engine, incremental):
+    """
+    Like _build_rows, but reuse the processed images of rows that are
+    unchanged in the incremental build and record the rest in it.
+    """
+    logger.info(f"Checking {len(rows)} entries for changes...")
+    sources = fetcher.fingerprint_all(row["image"] for row in rows)
+    fingerprints = []
+    images = []
+    changed = []
+    for index, (row, (source_fingerprint, _)) in enumerate(zip(rows, sources)):
+        fingerprint = row_fingerprint(
+            row,
+            source_fingerprint,
+            pipeline.cache_options(row["crop"], row["resize"]),
+        )
+        fingerprints.append(fingerprint)
+        images.append(incremental.get_image(fingerprint))
+        if images[-1] is None:
+            changed.append(index)
+    logger.info(
+        f"{len(rows) - len(changed)} unchanged, {len(changed)} to rebuild."
+    )
+    if changed:
+        # Sources that were read to fingerprint them are not fetched again.
+        to_fetch = [i for i in changed if sources[i][1] is None]
+        fetched = fetcher.fetch_all(rows[i]["image"] for i in to_fetch)
+        fetched = dict(zip(to_fetch, fetched))
+        processed = _process_rows(
+            [rows[i] for i in changed],
+            [fetched[i] if i in fetched else sources[i][1] for i in changed],
+            pipeline,
+            cache,
+            engine,
+        )
+        for index, img_data in zip(changed, processed):
+            images[index] = img_data
+            incremental.put_image(fingerprints[index], img_data)
+    return images
+
+
+def iter_castlist(
+    castlist,
+    castlist_path,
+    fetch_workers=DEFAULT_WORKERS,
+    session=None,
+    cache=None,
+    engine=None,
+    detection=DEFAULT_DETECTION,
+    pipeline=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    spool=None,
+    incremental=None,
+):
+    """
+    Given an imported cast list (any iterable of row dictionaries) and the
+    directory (as a Path) where the CSV file is located, lazily yield a
+    WaveTool player entry for each row with its image downloaded and processed.
+    Rows are handled chunk_size at a time, so only one chunk of images is in
+    memory at once. If a spool (spool.ImageSpool) is given, each final image
+    is written to it and the entry's "Image" is a SpooledImage reference.
+    Within a chunk, image sources are fetched concurrently (see fetch.py); an
+    optional requests session may be supplied, e.g. to point at a test server.
+    If an ImageCache is given, processed images are looked up by a hash of
+    the source bytes and the crop/resize flags, and hits skip processing.
+    Cropping and resizing run on a CropEngine process pool (the shared one
+    unless engine is given); an image that fails only affects its own row.
+    Images are processed by an ImagePipeline (decode once, crop, thumbnail,
+    encode once); detection selects the face detection strategy used by the
+    default pipeline when cropping.
+    If an open incremental.IncrementalBuild is given, rows whose inputs are
+    unchanged since its last build reuse their processed image, and only the
+    other rows are fetched and processed.
+    """
+    pipeline = pipeline or ImagePipeline(detection=detection)
+    rows_iter = iter(castlist)
+    with ImageFetcher(
+        castlist_path, session=session, max_workers=fetch_workers
+    ) as fetcher:
+        while True:
+            rows = list(islice(rows_iter, chunk_size))
+            if not rows:
+                break
+            if incremental is not None:
+                images = _reuse_rows(
+                    rows, fetcher, pipeline, cache, engine, incremental
+                )
+            else:
+                images = _build_rows(rows, fetcher, pipeline, cache, engine)
+            for row, img_data in zip(rows, images):
+                if spool is not None:
+                    img_data = spool.add(img_data, shared=is_asset(img_data))
+                yield make_cast_dict(row, img_data)
+
+
+def build_castlist(castlist, castlist_path, **kwargs):
+    """
+    Given an imported cast list (list of dictionaries) and the directory (as a Path)
+    where the CSV file is located, process each row to download and process images.
+    Returns a new list (wavetool_castlist) that is used for output generation.
+    Keyword arguments are those of iter_castlist.
+    """
+    return list(iter_castlist(castlist, castlist_path, **kwargs))
+
+
+def add_image_arguments(parser):
+    """
+    Add the image processing command line options to an argparse parser.
+    """
+    parser.add_argument(
+        "--detector",
+        choices=DETECTION_MODELS,
+        default=DEFAULT_DETECTION.model,
+        help="face detection model used when cropping (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--detect-size",
+        type=int,
+        default=DEFAULT_DETECTION.proxy_size,
+        help="longest edge of the downscaled image that face detection "
+        "runs on; 0 uses the full resolution (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--detect-batch-size",
+        type=int,
+        default=DEFAULT_DETECT_BATCH,
+        help="number of images whose faces the CNN detector locates "
+        "together; 1 detects one image at a time (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--image-backend",
+        choices=IMAGE_BACKENDS,
+        default="pillow",
+        help="library used to process images; vips keeps memory flat for "
+        "large originals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--image-format",
+        choices=("JPEG", "PNG", "TIFF"),
+        default="JPEG",
+        help="format of the processed images (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        default=75,
+        help="JPEG quality of the processed images (default: %(default)s)",
+    )
+
+
+def pipeline_from_args(args):
+    detection = DetectionStrategy(
+        model=args.detector,
+        proxy_size=args.detect_size,
+        upsample=DEFAULT_DETECTION.upsample,
+    )
+    return make_pipeline(
+        args.image_backend,
+        detection=detection,
+        output_format=args.image_format,
+        quality=args.image_quality,
+        detect_batch_size=args.detect_batch_size,
+    )
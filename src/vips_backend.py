@@ -0,0 +1,168 @@
+import logging
+from util import (
+    ImagePipeline,
+    face_crop_box,
+    needs_detection_proxy,
+    scale_face_location,
+    DEFAULT_DETECTION,
+)
+from metrics import span
+
+"""
+libvips image backend.
+
+pyvips processes images as streams of small regions and can shrink JPEGs
+while decoding them, so memory stays flat however large the originals are.
+VipsImagePipeline is a drop-in replacement for util.ImagePipeline, and
+crop_image / resize_image mirror the functions of the same name in util.
+pyvips is only imported when an image is processed, so selecting the Pillow
+backend never requires libvips to be installed.
+"""
+
+logger = logging.getLogger("util.vips")
+
+SAVE_SUFFIXES = {"JPEG": ".jpg", "PNG": ".png", "TIFF": ".tif"}
+
+
+def _to_srgb(image):
+    if image.hasalpha():
+        image = image.flatten(background=[255])
+    if image.interpretation not in ("srgb", "b-w"):
+        image = image.colourspace("srgb")
+    return image
+
+
+def _to_array(image):
+    import numpy
+
+    image = _to_srgb(image)
+    if image.bands == 1:
+        image = image.bandjoin([image, image])
+    image = image.cast("uchar")
+    return numpy.ndarray(
+        buffer=image.write_to_memory(),
+        dtype=numpy.uint8,
+        shape=[image.height, image.width, image.bands],
+    )
+
+
+class VipsImagePipeline(ImagePipeline):
+    """
+    ImagePipeline implemented with libvips' shrink-on-load thumbnailing.
+    """
+
+    backend = "vips"
+
+    def _thumbnail(self, image_buffer, size):
+        import pyvips
+
+        return pyvips.Image.thumbnail_buffer(
+            image_buffer, size[0], height=size[1], size="down"
+        )
+
+    def detect(self, image):
+        """
+        Locate the first face in a pyvips image, detecting on a proxy no
+        larger than detection.proxy_size. Returns (top, right, bottom, left)
+        in the image's coordinates, or None.
+        """
+        import face_recognition
+
+        proxy = image
+        image_size = (image.width, image.height)
+        if needs_detection_proxy(image_size, self.detection):
+            proxy_size = self.detection.proxy_size
+            proxy = image.thumbnail_image(
+                proxy_size, height=proxy_size, size="down"
+            )
+        with span("detect"):
+            face_locations = face_recognition.face_locations(
+                _to_array(proxy),
+                number_of_times_to_upsample=self.detection.upsample,
+                model=self.detection.model,
+            )
+        logger.info(f"Debug: Detected face locations: {face_locations}")
+        if not face_locations:
+            return None
+        return scale_face_location(
+            face_locations[0], (proxy.width, proxy.height), image_size
+        )
+
+    def encode(self, image):
+        suffix = SAVE_SUFFIXES[self.output_format]
+        with span("encode"):
+            if suffix == ".jpg":
+                return _to_srgb(image).write_to_buffer(suffix, Q=self.quality)
+            return image.write_to_buffer(suffix)
+
+    def process(self, image_buffer, crop, resize):
+        import pyvips
+
+        if not image_buffer or not (crop or resize):
+            return image_buffer
+        if not crop:
+            with span("decode"):
+                image = self._thumbnail(image_buffer, self.size)
+            return self.encode(image)
+        # libvips evaluates lazily, so most of the pixel work is timed as
+        # part of encode rather than the stage that asked for it.
+        with span("decode"):
+            if resize:
+                image = self._thumbnail(
+                    image_buffer, (self.draft_size, self.draft_size)
+                )
+            else:
+                image = pyvips.Image.new_from_buffer(image_buffer, "")
+        logger.info(
+            f"Debug: Successfully opened image. "
+            f"Size: {(image.width, image.height)}"
+        )
+        face_location = self.detect(image)
+        if face_location is None:
+            logger.info("Debug: No faces found in image. Skipping crop.")
+        else:
+            left, top, right, bottom = face_crop_box(
+                face_location, (image.width, image.height)
+            )
+            left, top = int(left), int(top)
+            with span("crop"):
+                image = image.crop(
+                    left, top, int(right) - left, int(bottom) - top
+                )
+        if resize:
+            with span("resize"):
+                image = image.thumbnail_image(
+                    self.size[0], height=self.size[1], size="down"
+                )
+        return self.encode(image)
+
+    def process_batch(self, jobs):
+        # Faces are detected on pyvips proxies, one image at a time.
+        results = []
+        for image_buffer, crop, resize in jobs:
+            try:
+                img_data = self.process(image_buffer, crop, resize)
+                results.append((img_data, None))
+            except Exception as e:
+                results.append((None, f"{type(e).__name__}: {e}"))
+        return results
+
+
+def crop_image(image_buffer, detection=DEFAULT_DETECTION):
+    return VipsImagePipeline(detection=detection).process(
+        image_buffer, crop=True, resize=False
+    )
+
+
+def resize_image(image_buffer):
+    return VipsImagePipeline().process(image_buffer, crop=False, resize=True)
+
+
+def rasterize_svg(svg_data, dpi):
+    """
+    Render an SVG document to PNG bytes at dpi.
+    """
+    import pyvips
+
+    image = pyvips.Image.svgload_buffer(svg_data, dpi=dpi)
+    return _to_srgb(image).write_to_buffer(".png")
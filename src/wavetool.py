@@ -0,0 +1,333 @@
+import os
+import sys
+import argparse
+import pathlib
+import traceback
+import contextlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from util import (
+    import_castlist,
+    iter_castlist,
+    add_image_arguments,
+    pipeline_from_args,
+)
+from fetch import DEFAULT_WORKERS
+from image_cache import ImageCache, default_cache
+from crop_engine import CropEngine
+from incremental import IncrementalBuild, build_dir_for
+from spool import ImageSpool
+from pla import PLA_FORMATS
+
+"""
+Build a cast list once and write any combination of outputs from it.
+
+    python wavetool.py castlist.csv --pla players.pla --pdf mic_cards.pdf
+
+Every image is downloaded and processed a single time however many outputs
+are requested, and the outputs are then written concurrently. Output formats
+are registered in WRITERS; make_players.py and mic_cards.py are wrappers
+that write a single format.
+"""
+
+Writer = namedtuple("Writer", ["name", "description", "write"])
+
+# Output formats by name. write(entries, out_fp, castlist_path, incremental,
+# args) writes the built entries to an open binary file; args holds the
+# parsed command line options.
+WRITERS = {}
+
+
+def register_writer(name, description, write):
+    WRITERS[name] = Writer(name, description, write)
+
+
+def _write_pla(entries, out_fp, castlist_path, incremental, args):
+    from make_players import create_wavetool_castlist
+
+    create_wavetool_castlist(
+        entries,
+        out_fp,
+        castlist_path,
+        fmt=args.pla_format,
+        compress_images=args.pla_compress_images,
+    )
+
+
+def _write_pdf(entries, out_fp, castlist_path, incremental, args):
+    from mic_cards import create_mic_cards
+
+    create_mic_cards(
+        entries,
+        out_fp,
+        castlist_path,
+        incremental=incremental,
+        chunk_size=args.pdf_chunk_size,
+        processes=args.workers,
+    )
+
+
+def _write_zip(entries, out_fp, castlist_path, incremental, args):
+    from mic_cards import create_mic_card_zip
+
+    create_mic_card_zip(
+        entries,
+        out_fp,
+        castlist_path,
+        incremental=incremental,
+        chunk_size=args.pdf_chunk_size,
+        processes=args.workers,
+    )
+
+
+def _write_pdf_and_zip(entries, out_fps, castlist_path, incremental, args):
+    from mic_cards import create_mic_cards_and_zip
+
+    pdf_fp, zip_fp = out_fps
+    create_mic_cards_and_zip(
+        entries,
+        pdf_fp,
+        zip_fp,
+        castlist_path,
+        incremental=incremental,
+        chunk_size=args.pdf_chunk_size,
+        processes=args.workers,
+    )
+
+
+register_writer("pla", "WaveTool 3 player file", _write_pla)
+register_writer("pdf", "mic cards PDF", _write_pdf)
+register_writer("zip", "zip of one PDF per mic card", _write_zip)
+
+# Outputs written together, from one rendering, when all of them are
+# requested. write() gets a tuple of open files, one per name.
+COMBINED_WRITERS = {
+    ("pdf", "zip"): Writer(
+        "pdf+zip", "mic cards PDF and zip", _write_pdf_and_zip
+    ),
+}
+
+
+def make_parser(output_format=None, usage=None):
+    """
+    Return the argument parser. With output_format, the parser takes a
+    single positional output file of that format (as the wrapper scripts
+    do); otherwise each registered format has its own --<name> option.
+    """
+    parser = argparse.ArgumentParser(
+        usage=usage,
+        description="Build a cast list once and write the requested outputs.",
+    )
+    parser.add_argument("castlist_file")
+    if output_format is not None:
+        parser.add_argument("output_file")
+    else:
+        for writer in WRITERS.values():
+            parser.add_argument(
+                f"--{writer.name}",
+                metavar="FILE",
+                help=f"write a {writer.description} to FILE",
+            )
+    add_image_arguments(parser)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes used to crop and resize images (and to render "
+        "mic cards, with --pdf-chunk-size); 0 processes them in this "
+        "process (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--pla-format",
+        choices=sorted(PLA_FORMATS),
+        default="xml",
+        help="property list format of the player file; binary files are "
+        "smaller and faster to write and import (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pla-compress-images",
+        action="store_true",
+        help="store player images as JPEGs scaled to 512x512 and mark them "
+        "Compressed and Scaled",
+    )
+    parser.add_argument(
+        "--pdf-chunk-size",
+        type=int,
+        default=None,
+        help="render mic cards this many at a time in parallel worker "
+        "processes and merge the chunks; 0 renders them in this process "
+        "(default: WAVETOOL_PDF_CHUNK_SIZE or 0)",
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="concurrent image downloads (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="processed image cache directory; an empty value disables "
+        "the cache (default: WAVETOOL_CACHE_DIR or "
+        "~/.cache/wavetool_utilities/images)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only reprocess rows that changed since the last incremental "
+        "build of the first output file (kept in <output file>.build)",
+    )
+    parser.add_argument(
+        "--incremental-pages",
+        action="store_true",
+        help="with --incremental, also reuse the rendered mic card pages of "
+        "unchanged rows; merging them is slower than rendering most decks "
+        "afresh",
+    )
+    parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="overwrite existing output files without asking",
+    )
+    return parser
+
+
+def outputs_from_args(args, output_format=None):
+    """
+    Return the requested outputs as a list of (writer, path).
+    """
+    if output_format is not None:
+        return [(WRITERS[output_format], args.output_file)]
+    return [
+        (writer, getattr(args, writer.name))
+        for writer in WRITERS.values()
+        if getattr(args, writer.name)
+    ]
+
+
+def cache_from_args(args):
+    if args.cache_dir is None:
+        return default_cache()
+    if not args.cache_dir:
+        return None
+    return ImageCache(os.path.expanduser(args.cache_dir))
+
+
+def confirm_overwrite(paths):
+    """
+    Ask before overwriting any existing output. Returns False if the user
+    declines.
+    """
+    for path in paths:
+        if os.path.isfile(path):
+            overwrite = input(
+                f"Output file {path} already exists. Overwrite? (y/n): "
+            )
+            if overwrite.lower() != "y":
+                return False
+    return True
+
+
+def combine_outputs(outputs):
+    """
+    Replace the outputs of each combined writer (see COMBINED_WRITERS) with
+    a single (combined writer, tuple of paths) output when all of them are
+    requested.
+    """
+    paths = {writer.name: path for writer, path in outputs}
+    for names, combined in COMBINED_WRITERS.items():
+        if all(name in paths for name in names):
+            outputs = [
+                output for output in outputs if output[0].name not in names
+            ]
+            outputs.append((combined, tuple(paths[name] for name in names)))
+    return outputs
+
+
+def write_outputs(entries, outputs, castlist_path, args, incremental=None):
+    """
+    Write every (writer, path) output from the built entries concurrently.
+    Returns the paths that could not be written.
+    """
+
+    def write(output):
+        writer, path = output
+        paths = path if isinstance(path, tuple) else (path,)
+        try:
+            with contextlib.ExitStack() as stack:
+                out_fps = tuple(
+                    stack.enter_context(open(p, "wb")) for p in paths
+                )
+                writer.write(
+                    entries,
+                    out_fps if isinstance(path, tuple) else out_fps[0],
+                    castlist_path,
+                    incremental,
+                    args,
+                )
+        except IOError:
+            print("Could not open file: " + ", ".join(paths))
+            traceback.print_exc()
+            return paths
+        return ()
+
+    outputs = combine_outputs(outputs)
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        return [
+            path for paths in executor.map(write, outputs) for path in paths
+        ]
+
+
+def main(argv=None, output_format=None, usage=None):
+    parser = make_parser(output_format, usage)
+    args = parser.parse_args(argv)
+    outputs = outputs_from_args(args, output_format)
+    if not outputs:
+        parser.error(
+            "no outputs requested; use "
+            + " and/or ".join(f"--{name} FILE" for name in WRITERS)
+        )
+    if not args.yes and not confirm_overwrite(path for _, path in outputs):
+        sys.exit(0)
+
+    castlist = import_castlist(args.castlist_file)
+    castlist_path = pathlib.Path(args.castlist_file).parent.resolve()
+    incremental = None
+    if args.incremental:
+        incremental = IncrementalBuild(
+            build_dir_for(outputs[0][1]), reuse_pages=args.incremental_pages
+        )
+        incremental.open()
+    engine = CropEngine(args.workers) if args.workers is not None else None
+    try:
+        with ImageSpool() as spool:
+            # Build the processed cast list once for every output.
+            entries = list(
+                iter_castlist(
+                    castlist,
+                    castlist_path,
+                    fetch_workers=args.fetch_workers,
+                    cache=cache_from_args(args),
+                    engine=engine,
+                    pipeline=pipeline_from_args(args),
+                    spool=spool,
+                    incremental=incremental,
+                )
+            )
+            failed = write_outputs(
+                entries, outputs, castlist_path, args, incremental
+            )
+        if failed:
+            sys.exit(1)
+        if incremental is not None:
+            incremental.save()
+    finally:
+        if incremental is not None:
+            incremental.close()
+        if engine is not None:
+            engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import os
-from bs4 import BeautifulSoup
+import argparse
 import plistlib
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
 
 """
 
@@ -13,31 +15,115 @@ Once you have located your devices in WSM, this will allow you to quickly import
 addresses into WaveTool as Sennheiser devices, reducing time and errors associated with
 more complex setups.
 
-"""
-
-
-def wsm_to_wtip(source_file, output_file):
-    ip_addresses = []
-    with open(source_file, "r") as f:
-        soup = BeautifulSoup(f, "xml")
-
-        ip_fields = soup.find_all("IPAddress")
+The WSM file is read as a stream, one element at a time, and each element is
+discarded once it has been read, so even very large multi-venue exports are
+converted in constant memory.
 
-        for ip_field in ip_fields:
-            ip_addresses.append([ip_field.text, 3])
+"""
 
-    plistlib.dump(ip_addresses, open(output_file, "wb"))
+# WaveTool's device type for Sennheiser hardware.
+SENNHEISER = 3
+
+# Child elements (or attributes) of a device that hold its name and type.
+NAME_TAGS = ("Name", "DeviceName", "Label")
+TYPE_TAGS = ("Type", "DeviceType", "Model")
+
+# How many levels above an IPAddress element to look for the device's name
+# and type.
+DEVICE_DEPTH = 2
+
+WsmDevice = namedtuple("WsmDevice", ["ip", "name", "type"])
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_wsm_devices(source_file, with_details=False):
+    """
+    Yield a WsmDevice for each distinct IP address in a WSM file, in the
+    order they appear. With with_details, the name and type of the device
+    each address belongs to are read from the enclosing elements' children
+    or attributes (see NAME_TAGS and TYPE_TAGS); otherwise they are None.
+    """
+    seen = set()
+    # One entry per open element: [element, details, pending addresses].
+    stack = []
+    for event, elem in iterparse(source_file, events=("start", "end")):
+        if event == "start":
+            details = {}
+            if with_details:
+                for key, value in elem.attrib.items():
+                    key = _local_name(key)
+                    if key in NAME_TAGS:
+                        details.setdefault("name", value)
+                    elif key in TYPE_TAGS:
+                        details.setdefault("type", value)
+            stack.append([elem, details, []])
+            continue
+
+        _, details, pending = stack.pop()
+        tag = _local_name(elem.tag)
+        text = (elem.text or "").strip()
+        parent = stack[-1] if stack else None
+        if tag == "IPAddress":
+            if text and text not in seen:
+                seen.add(text)
+                if with_details and parent is not None:
+                    parent[2].append((text, 0))
+                else:
+                    yield WsmDevice(text, None, None)
+        elif with_details and parent is not None and text:
+            if tag in NAME_TAGS:
+                parent[1].setdefault("name", text)
+            elif tag in TYPE_TAGS:
+                parent[1].setdefault("type", text)
+
+        if pending:
+            if details or parent is None:
+                for ip, _ in pending:
+                    yield WsmDevice(
+                        ip, details.get("name"), details.get("type")
+                    )
+            else:
+                for ip, depth in pending:
+                    if depth + 1 < DEVICE_DEPTH:
+                        parent[2].append((ip, depth + 1))
+                    else:
+                        yield WsmDevice(ip, None, None)
+        # Everything needed from this element has been taken.
+        elem.clear()
+        if parent is not None:
+            parent[0].remove(elem)
+
+
+def wsm_to_wtip(source_file, output_file, with_details=False):
+    """
+    Write a WaveTool IP list with each distinct address in the WSM file as
+    a Sennheiser device, and return the WsmDevices found.
+    """
+    devices = list(iter_wsm_devices(source_file, with_details))
+    with open(output_file, "wb") as out_fp:
+        plistlib.dump([[device.ip, SENNHEISER] for device in devices], out_fp)
+    return devices
 
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) < 3:
-        print("Usage: wsm_to_wtip.py <source_file> <output_file>")
-        sys.exit(1)
-
-    source_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        usage="wsm_to_wtip.py [--devices] <source_file> <output_file>"
+    )
+    parser.add_argument("source_file")
+    parser.add_argument("output_file")
+    parser.add_argument(
+        "--devices",
+        action="store_true",
+        help="also list each address with its device name and type",
+    )
+    args = parser.parse_args()
+    source_file = args.source_file
+    output_file = args.output_file
 
     if not os.path.isfile(source_file):
         print(f"Error: {source_file} is not a file")
@@ -50,4 +136,11 @@ if __name__ == "__main__":
         if overwrite != "y":
             exit(0)
 
-    wsm_to_wtip(source_file, output_file)
+    devices = wsm_to_wtip(source_file, output_file, args.devices)
+
+    if args.devices:
+        for device in devices:
+            print(
+                f"{device.ip:<16} {device.name or '-':<24} "
+                f"{device.type or '-'}"
+            )